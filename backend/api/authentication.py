@@ -0,0 +1,121 @@
+import copy
+import time
+from collections import OrderedDict
+from threading import Lock
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+from recipes.models import Recipe
+from users.models import Subscription
+
+User = get_user_model()
+
+
+class TokenUserCache:
+    """LRU cache of the user and token behind each token key.
+
+    Up to `max_tokens` entries are kept in process memory for `ttl`
+    seconds. Changing a user or deleting their token stores the time of
+    the change in the Django cache, and entries loaded before it are
+    dropped on their next read, so logout, a password change or
+    deactivation takes effect in every process sharing that cache.
+
+    Only changes that send model signals are seen. After a queryset
+    `update()` of users, such as a bulk deactivation, call `invalidate`
+    for each of them, or the change only applies once `ttl` has passed.
+    Without an explicit `ttl` the `TOKEN_CACHE_TTL` setting is used.
+    """
+    changed_key = 'token-user-changed:{}'
+
+    def __init__(self, max_tokens=1024, ttl=None):
+        self.max_tokens = max_tokens
+        self._ttl = ttl
+        self.lock = Lock()
+        self.entries = OrderedDict()
+
+    @property
+    def ttl(self):
+        return settings.TOKEN_CACHE_TTL if self._ttl is None else self._ttl
+
+    def get(self, key):
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+        if entry is None:
+            return None
+
+        loaded, user, token = entry
+        changed = cache.get(self.changed_key.format(user.pk))
+        if loaded + self.ttl < now or (changed and changed >= loaded):
+            with self.lock:
+                if self.entries.get(key) is entry:
+                    del self.entries[key]
+            return None
+
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+        return user, token
+
+    def store(self, key, loaded, user, token):
+        with self.lock:
+            self.entries[key] = (loaded, user, token)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_tokens:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, user_id):
+        """Drop the user's cached tokens once the transaction commits."""
+        transaction.on_commit(lambda: cache.set(
+            self.changed_key.format(user_id), time.time(), self.ttl
+        ))
+
+
+token_users = TokenUserCache()
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """`TokenAuthentication` that skips the token query for known keys.
+
+    Every request gets its own copy of the cached user, so changes made
+    to `request.user` never leak into other requests.
+    """
+
+    def authenticate_credentials(self, key):
+        cached = token_users.get(key)
+        if cached is None:
+            loaded = time.time()
+            user, token = super().authenticate_credentials(key)
+            token_users.store(key, loaded, user, token)
+        else:
+            user, token = cached
+
+        return copy.copy(user), token
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_user_tokens(sender, instance, **kwargs):
+    token_users.invalidate(instance.pk)
+
+
+@receiver(post_delete, sender=Token)
+def invalidate_deleted_token(sender, instance, **kwargs):
+    token_users.invalidate(instance.user_id)
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+@receiver(post_save, sender=Subscription)
+@receiver(post_delete, sender=Subscription)
+def invalidate_author_tokens(sender, instance, created=True, **kwargs):
+    # The cached user carries recipes_count and followers_count.
+    if created:
+        token_users.invalidate(instance.author_id)
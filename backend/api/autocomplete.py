@@ -0,0 +1,114 @@
+import time
+from bisect import bisect_left, bisect_right
+from threading import Lock
+from uuid import uuid4
+
+from django.core.cache import cache
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from recipes.models import Ingredient
+from recipes.signals import bulk_changed
+
+
+class IngredientIndex:
+    """In-memory autocomplete index over ingredient names.
+
+    Names are kept case-folded and sorted, so prefix matches are found by
+    binary search. Every name is also joined into one string, which lets
+    substring matches be found with `str.find` instead of a Python loop.
+
+    The index is rebuilt lazily when its version token in the Django cache
+    changes, which any process can trigger with `invalidate()`, or when it
+    is older than `max_age` seconds, which covers writes made without it.
+    """
+    version_key = 'ingredient-index-version'
+    separator = '\n'
+
+    def __init__(self, max_age=300):
+        self.max_age = max_age
+        self.lock = Lock()
+        self.version = None
+        self.built_at = 0
+        self.snapshot = ([], [], [], '')
+
+    @classmethod
+    def invalidate(cls):
+        cache.set(cls.version_key, uuid4().hex, None)
+
+    def current_version(self):
+        version = cache.get(self.version_key)
+        if version is None:
+            cache.add(self.version_key, uuid4().hex, None)
+            version = cache.get(self.version_key)
+        return version
+
+    def build(self, version):
+        entries = sorted(
+            (name.casefold(), pk)
+            for pk, name in Ingredient.objects.values_list('id', 'name')
+        )
+        keys = [key for key, pk in entries]
+        offsets = []
+        offset = 0
+        for key in keys:
+            offsets.append(offset)
+            offset += len(key) + len(self.separator)
+        self.snapshot = (
+            keys,
+            [pk for key, pk in entries],
+            offsets,
+            self.separator.join(keys),
+        )
+        self.version = version
+        self.built_at = time.monotonic()
+
+    def is_stale(self, version):
+        return (
+            version != self.version
+            or time.monotonic() - self.built_at > self.max_age
+        )
+
+    def refresh(self):
+        version = self.current_version()
+        if self.is_stale(version):
+            with self.lock:
+                if self.is_stale(version):
+                    self.build(version)
+
+    def search(self, query, limit):
+        """Return IDs of matching ingredients, prefix matches first."""
+        query = query.replace(self.separator, ' ').casefold()
+        if not query:
+            return []
+
+        self.refresh()
+        keys, ids, offsets, blob = self.snapshot
+
+        start = bisect_left(keys, query)
+        end = bisect_left(keys, query[:-1] + chr(ord(query[-1]) + 1), start)
+        results = ids[start:min(end, start + limit)]
+
+        position = 0
+        while len(results) < limit:
+            position = blob.find(query, position)
+            if position == -1:
+                break
+            index = bisect_right(offsets, position) - 1
+            if not start <= index < end:
+                results.append(ids[index])
+            if index + 1 == len(keys):
+                break
+            position = offsets[index + 1]
+
+        return results
+
+
+ingredient_index = IngredientIndex()
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+@receiver(bulk_changed, sender=Ingredient)
+def invalidate_ingredient_index(**kwargs):
+    IngredientIndex.invalidate()
@@ -0,0 +1,362 @@
+import hashlib
+import time
+from collections import Counter, OrderedDict, namedtuple
+from threading import Lock
+from uuid import uuid4
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache, caches
+from django.db import transaction
+from django.db.models import Value
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.response import Response
+
+from recipes.models import (Favorite, Ingredient, IngredientInRecipe, Recipe,
+                            ShoppingCart, Tag)
+from recipes.signals import bulk_changed, recipe_is_deleted
+from recipes.thumbnails import thumbnails_ready
+from users.models import Subscription
+
+User = get_user_model()
+
+
+class ResponseCache:
+    """Cache of anonymous API responses with tag-based invalidation.
+
+    Every entry records the current version of each tag it depends on,
+    such as `recipe:<id>` or `user:<id>`. Invalidating a tag replaces its
+    version, so all entries that depend on it become misses on their next
+    read, while unrelated entries stay cached.
+    """
+    alias = 'responses'
+    prefix = 'response'
+
+    def __init__(self):
+        self.lock = Lock()
+        self.stats = Counter()
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def count(self, event):
+        with self.lock:
+            self.stats[event] += 1
+
+    def key(self, request):
+        query = sorted(
+            (name, value)
+            for name in request.query_params
+            for value in request.query_params.getlist(name)
+        )
+        digest = hashlib.md5(
+            repr((request.get_host(), request.path, query)).encode()
+        ).hexdigest()
+        return f'{self.prefix}:{digest}'
+
+    def tag_key(self, tag):
+        return f'{self.prefix}-tag:{tag}'
+
+    def get(self, request):
+        entry = self.cache.get(self.key(request))
+        if entry is not None:
+            versions = self.cache.get_many(list(entry['versions']))
+            if versions == entry['versions']:
+                self.count('hits')
+                return entry['data']
+
+        self.count('misses')
+        return None
+
+    def set(self, request, data, tags):
+        """Store `data` unless it may have been read from a stale replica.
+
+        A tag invalidated less than `REPLICA_STICKY_SECONDS` ago may not
+        have reached every replica yet, so responses depending on it are
+        served without being cached until the window has passed.
+        """
+        tag_keys = [self.tag_key(tag) for tag in set(tags)]
+        versions = self.cache.get_many(tag_keys)
+        if settings.REPLICA_DATABASES:
+            settled = time.time() - settings.REPLICA_STICKY_SECONDS
+            if any(changed > settled for _, changed in versions.values()):
+                return
+
+        missing = {
+            key: (uuid4().hex, 0) for key in tag_keys if key not in versions
+        }
+        if missing:
+            self.cache.set_many(missing, None)
+            versions.update(missing)
+
+        self.cache.set(
+            self.key(request), {'data': data, 'versions': versions}
+        )
+
+    def invalidate(self, *tags):
+        """Replace the versions of `tags` once the transaction commits.
+
+        Invalidating after the commit keeps a concurrent read from caching
+        the old rows again between the invalidation and the commit.
+        """
+        keys = [self.tag_key(tag) for tag in tags]
+        transaction.on_commit(lambda: self.replace_versions(keys))
+
+    def replace_versions(self, keys):
+        changed = time.time()
+        self.cache.set_many(
+            {key: (uuid4().hex, changed) for key in keys}, None
+        )
+        self.count('invalidations')
+
+
+response_cache = ResponseCache()
+
+
+class CachedResponseMixin:
+    """Serve `list` and `retrieve` for anonymous users from the cache."""
+    cached_actions = ('list', 'retrieve')
+
+    def get_cache_tags(self, data):
+        return ['catalog']
+
+    def dispatch_cached(self, handler, request, *args, **kwargs):
+        if (self.action not in self.cached_actions
+                or request.user.is_authenticated):
+            return handler(request, *args, **kwargs)
+
+        data = response_cache.get(request)
+        if data is not None:
+            return Response(data, headers={'X-Cache': 'HIT'})
+
+        response = handler(request, *args, **kwargs)
+        if response.status_code == 200:
+            response_cache.set(
+                request, response.data, self.get_cache_tags(response.data)
+            )
+            response['X-Cache'] = 'MISS'
+
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.dispatch_cached(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.dispatch_cached(
+            super().retrieve, request, *args, **kwargs
+        )
+
+
+RecipeSets = namedtuple('RecipeSets', ('favorites', 'cart'))
+
+
+class UserRecipeSetsCache:
+    """LRU cache of the recipe IDs each user favorited or put in the cart.
+
+    Both sets are loaded with one query and kept in process memory for up
+    to `max_users` users and `max_age` seconds, dropping the least
+    recently used one. Every write replaces the user's version token in
+    the Django cache, so other processes reload their copy on the next
+    read. The writing process updates its copy in place, but only when
+    that copy was current before the write.
+    """
+    version_key = 'recipe-sets-version:{}'
+    empty = RecipeSets(frozenset(), frozenset())
+
+    def __init__(self, max_users=1024, max_age=300):
+        self.max_users = max_users
+        self.max_age = max_age
+        self.lock = Lock()
+        self.entries = OrderedDict()
+
+    def current_version(self, user_id):
+        key = self.version_key.format(user_id)
+        version = cache.get(key)
+        if version is None:
+            cache.add(key, uuid4().hex, None)
+            version = cache.get(key)
+        return version
+
+    def load(self, user_id):
+        favorites, cart = set(), set()
+        rows = Favorite.objects.filter(user=user_id).values_list(
+            'recipe_id', Value(0)
+        ).union(
+            ShoppingCart.objects.filter(user=user_id).values_list(
+                'recipe_id', Value(1)
+            ),
+            all=True,
+        )
+        for recipe_id, in_cart in rows:
+            (cart if in_cart else favorites).add(recipe_id)
+        return RecipeSets(frozenset(favorites), frozenset(cart))
+
+    def store(self, user_id, version, sets, loaded=None):
+        if loaded is None:
+            loaded = time.monotonic()
+        with self.lock:
+            self.entries[user_id] = (version, loaded, sets)
+            self.entries.move_to_end(user_id)
+            while len(self.entries) > self.max_users:
+                self.entries.popitem(last=False)
+
+    def get(self, user_id):
+        version = self.current_version(user_id)
+        with self.lock:
+            entry = self.entries.get(user_id)
+            if (entry is not None and entry[0] == version
+                    and time.monotonic() - entry[1] <= self.max_age):
+                self.entries.move_to_end(user_id)
+                return entry[2]
+
+        sets = self.load(user_id)
+        self.store(user_id, version, sets)
+        return sets
+
+    def update(self, user_id, field=None, recipe_ids=(), added=True):
+        """Record that `recipe_ids` were added to or removed from a set.
+
+        The local copy is patched only if it matched the shared version
+        before this write, as otherwise it misses another process's write.
+        Without a `field`, or with a stale copy, the user's sets are
+        dropped and reloaded on the next read.
+        """
+        key = self.version_key.format(user_id)
+        previous = cache.get(key)
+        version = uuid4().hex
+        cache.set(key, version, None)
+        with self.lock:
+            entry = self.entries.pop(user_id, None)
+        if entry is None or field is None or entry[0] != previous:
+            return
+
+        _, loaded, sets = entry
+        ids = getattr(sets, field)
+        ids = ids.union(recipe_ids) if added else ids.difference(recipe_ids)
+        self.store(user_id, version, sets._replace(**{field: ids}), loaded)
+
+    def refresh(self, user_id, field=None, recipe_ids=(), added=True):
+        """Schedule `update` for when the current transaction commits."""
+        transaction.on_commit(
+            lambda: self.update(user_id, field, recipe_ids, added)
+        )
+
+
+user_recipe_sets = UserRecipeSetsCache()
+
+
+def get_recipe_sets(request):
+    """Return the favorite and cart recipe IDs of the requesting user.
+
+    The sets are looked up once per request, anonymous users get empty
+    ones.
+    """
+    if not hasattr(request, 'recipe_sets'):
+        if request.user.is_anonymous:
+            request.recipe_sets = UserRecipeSetsCache.empty
+        else:
+            request.recipe_sets = user_recipe_sets.get(request.user.pk)
+
+    return request.recipe_sets
+
+
+def recipe_cache_tags(data):
+    """Tags for a serialized recipe, a page of them or a plain list."""
+    if isinstance(data, dict) and 'results' in data:
+        data = data['results']
+    recipes = data if isinstance(data, list) else [data]
+
+    tags = ['catalog']
+    for recipe in recipes:
+        tags.append(f'recipe:{recipe["id"]}')
+        tags.append(f'user:{recipe["author"]["id"]}')
+    return tags
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+def invalidate_recipe(sender, instance, **kwargs):
+    response_cache.invalidate(
+        'recipe-list',
+        f'recipe:{instance.pk}',
+        f'user:{instance.author_id}',
+    )
+
+
+@receiver(thumbnails_ready, sender=Recipe)
+def invalidate_thumbnails(sender, recipe_id, **kwargs):
+    response_cache.invalidate(f'recipe:{recipe_id}')
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def invalidate_recipe_tags(sender, instance, reverse, **kwargs):
+    if reverse:
+        response_cache.invalidate('recipe-list', 'catalog')
+    else:
+        response_cache.invalidate('recipe-list', f'recipe:{instance.pk}')
+
+
+@receiver(post_save, sender=IngredientInRecipe)
+@receiver(post_delete, sender=IngredientInRecipe)
+@receiver(post_save, sender=Favorite)
+@receiver(post_delete, sender=Favorite)
+@receiver(post_save, sender=ShoppingCart)
+@receiver(post_delete, sender=ShoppingCart)
+def invalidate_recipe_relation(sender, instance, **kwargs):
+    # The recipe's own delete already invalidates it.
+    if not recipe_is_deleted(instance.recipe_id):
+        response_cache.invalidate(f'recipe:{instance.recipe_id}')
+
+
+@receiver(post_save, sender=Favorite)
+@receiver(post_save, sender=ShoppingCart)
+def refresh_recipe_sets_on_save(sender, instance, created, **kwargs):
+    field = 'favorites' if sender is Favorite else 'cart'
+    if created:
+        user_recipe_sets.refresh(
+            instance.user_id, field, {instance.recipe_id}, added=True
+        )
+    else:
+        user_recipe_sets.refresh(instance.user_id)
+
+
+@receiver(post_delete, sender=Favorite)
+@receiver(post_delete, sender=ShoppingCart)
+def refresh_recipe_sets_on_delete(sender, instance, **kwargs):
+    # A deleted recipe left in the sets matches nothing.
+    if recipe_is_deleted(instance.recipe_id):
+        return
+
+    field = 'favorites' if sender is Favorite else 'cart'
+    user_recipe_sets.refresh(
+        instance.user_id, field, {instance.recipe_id}, added=False
+    )
+
+
+@receiver(post_save, sender=Subscription)
+@receiver(post_delete, sender=Subscription)
+def invalidate_subscription(sender, instance, **kwargs):
+    response_cache.invalidate(f'user:{instance.author_id}')
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_user(sender, instance, **kwargs):
+    response_cache.invalidate(f'user:{instance.pk}')
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+def invalidate_catalog(sender, **kwargs):
+    response_cache.invalidate('catalog')
+
+
+@receiver(bulk_changed)
+def invalidate_bulk_change(sender, **kwargs):
+    # Bulk writes can touch any recipe, and every entry depends on the
+    # catalog tag.
+    response_cache.invalidate('catalog')
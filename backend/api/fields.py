@@ -0,0 +1,105 @@
+import base64
+import binascii
+import re
+import uuid
+
+from django.core.files.uploadedfile import TemporaryUploadedFile
+from drf_extra_fields.fields import Base64ImageField
+from rest_framework.fields import Field, ImageField
+from rest_framework.validators import ValidationError
+
+
+def file_url(file, request=None):
+    """Represent a stored file the way DRF's `FileField` does."""
+    if not file:
+        return None
+
+    try:
+        url = file.url
+    except AttributeError:
+        return None
+
+    if request is not None:
+        return request.build_absolute_uri(url)
+    return url
+
+
+class StreamingBase64ImageField(Base64ImageField):
+    """Base64 image field that decodes the payload in bounded chunks.
+
+    The decoded bytes are written straight to a temporary file instead of
+    being materialised as one more in-memory copy of the upload, and
+    Pillow validates the image from that file.
+    """
+    chunk_size = 4 * 64 * 1024
+    # b64decode skips these anyway, but they would break chunk alignment.
+    ignored_characters = re.compile('[^A-Za-z0-9+/=]')
+    max_size = 20 * 1024 * 1024
+    sniff_size = 261
+
+    def to_internal_value(self, base64_data):
+        if base64_data in self.EMPTY_VALUES or not isinstance(
+            base64_data, str
+        ):
+            return super().to_internal_value(base64_data)
+
+        marker = base64_data.find(';base64,')
+        header = base64_data[:marker] if marker != -1 else ''
+        offset = marker + len(';base64,') if marker != -1 else 0
+        if (len(base64_data) - offset) // 4 * 3 > self.max_size:
+            raise ValidationError(
+                f'Image must not exceed {self.max_size // 1024 // 1024} MB.'
+            )
+
+        file = TemporaryUploadedFile(
+            str(uuid.uuid4()), header.replace('data:', '') or None, 0, None
+        )
+        try:
+            remainder = ''
+            for start in range(offset, len(base64_data), self.chunk_size):
+                chunk = remainder + self.ignored_characters.sub(
+                    '', base64_data[start:start + self.chunk_size]
+                )
+                aligned = len(chunk) // 4 * 4
+                file.write(base64.b64decode(chunk[:aligned]))
+                remainder = chunk[aligned:]
+            file.write(base64.b64decode(remainder))
+        except (TypeError, binascii.Error, ValueError):
+            file.close()
+            raise ValidationError(self.INVALID_FILE_MESSAGE)
+
+        file.size = file.tell()
+        file.seek(0)
+        extension = self.get_file_extension(
+            file.name, file.read(self.sniff_size)
+        )
+        if extension not in self.ALLOWED_TYPES:
+            file.close()
+            raise ValidationError(self.INVALID_TYPE_MESSAGE)
+
+        file.name = f'{file.name}.{extension}'
+        file.seek(0)
+        return ImageField.to_internal_value(self, file)
+
+
+class RecipeThumbnailsField(Field):
+    """URLs of the thumbnail variants of a recipe photo.
+
+    Variants are generated after the recipe is saved, so a variant is
+    `None` until it is ready and clients should fall back to `image`.
+    """
+
+    def __init__(self, **kwargs):
+        kwargs['source'] = '*'
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, recipe):
+        return thumbnail_urls(recipe, self.context.get('request'))
+
+
+def thumbnail_urls(recipe, request=None):
+    return {
+        'webp': file_url(recipe.thumbnail_webp, request),
+        'jpeg': file_url(recipe.thumbnail_jpeg, request),
+    }
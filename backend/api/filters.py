@@ -1,15 +1,35 @@
 from django.contrib.auth import get_user_model
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db import connection
+from django.db.models import Case, F, Q, When
 from django_filters.rest_framework import FilterSet, filters
-from rest_framework.filters import SearchFilter
+from rest_framework.filters import BaseFilterBackend
 
-from recipes.models import Recipe, Tag
+from recipes.models import SEARCH_CONFIG, Recipe, Tag
 
+from .autocomplete import ingredient_index
+from .cache import get_recipe_sets
 
 User = get_user_model()
 
 
-class CustomSearchFilter(SearchFilter):
+class IngredientAutocompleteFilter(BaseFilterBackend):
+    """Match ingredients by name: prefix matches first, then substrings."""
     search_param = 'name'
+    max_results = 50
+
+    def filter_queryset(self, request, queryset, view):
+        query = request.query_params.get(self.search_param, '').strip()
+        if not query or view.action != 'list':
+            return queryset
+
+        ids = ingredient_index.search(query, self.max_results)
+        if not ids:
+            return queryset.none()
+
+        return queryset.filter(pk__in=ids).order_by(
+            Case(*[When(pk=pk, then=rank) for rank, pk in enumerate(ids)])
+        )
 
 
 class RecipeFilterSet(FilterSet):
@@ -17,6 +37,11 @@ class RecipeFilterSet(FilterSet):
         field_name='tags__slug',
         to_field_name='slug',
         queryset=Tag.objects.all(),
+        method='filter_tags',
+    )
+    tags_match = filters.ChoiceFilter(
+        choices=(('any', 'any'), ('all', 'all')),
+        method='filter_tags_match',
     )
     author = filters.ModelChoiceFilter(queryset=User.objects.all())
     is_favorited = filters.BooleanFilter(
@@ -25,13 +50,56 @@ class RecipeFilterSet(FilterSet):
     is_in_shopping_cart = filters.BooleanFilter(
         method='filter_is_in_shopping_cart'
     )
+    search = filters.CharFilter(method='filter_search')
+    ordering = filters.ChoiceFilter(
+        choices=(
+            ('newest', 'newest'),
+            ('popular', 'popular'),
+            ('trending', 'trending'),
+        ),
+        method='filter_ordering',
+    )
+
+    orderings = {
+        'newest': ('-pub_date', '-id'),
+        'popular': ('-favorites_count', '-id'),
+        'trending': ('-trending_score', '-id'),
+    }
+
+    def filter_tags(self, queryset, name, value):
+        if not value:
+            return queryset
+
+        # A tag without a bit is on no recipe until rebuild_tags_masks.
+        if self.data.get('tags_match') == 'all' and any(
+            tag.bit is None for tag in value
+        ):
+            return queryset.none()
+
+        mask = Tag.mask(tag.bit for tag in value)
+        if not mask:
+            return queryset.none()
+
+        queryset = queryset.alias(
+            matched_tags=F('tags_mask').bitand(mask)
+        )
+
+        if self.data.get('tags_match') == 'all':
+            return queryset.filter(matched_tags=mask)
+
+        return queryset.exclude(matched_tags=0)
+
+    def filter_tags_match(self, queryset, name, value):
+        return queryset
 
     def filter_is_favorited(self, queryset, name, value):
         if self.request.user.is_anonymous:
             return False
 
         if value:
-            return queryset.filter(favorite__user=self.request.user)
+            return queryset.filter(
+                pk__in=get_recipe_sets(self.request).favorites
+            )
 
         return queryset
 
@@ -40,10 +108,26 @@ class RecipeFilterSet(FilterSet):
             return False
 
         if value:
-            return queryset.filter(cart__user=self.request.user)
+            return queryset.filter(pk__in=get_recipe_sets(self.request).cart)
 
         return queryset
 
+    def filter_search(self, queryset, name, value):
+        if connection.vendor != 'postgresql':
+            return queryset.filter(
+                Q(name__icontains=value) | Q(text__icontains=value)
+            )
+
+        query = SearchQuery(
+            value, config=SEARCH_CONFIG, search_type='websearch'
+        )
+        return queryset.filter(search_vector=query).annotate(
+            search_rank=SearchRank(F('search_vector'), query)
+        ).order_by('-search_rank', '-pub_date', '-id')
+
+    def filter_ordering(self, queryset, name, value):
+        return queryset.order_by(*self.orderings[value])
+
     class Meta:
         model = Recipe
         fields = (
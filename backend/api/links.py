@@ -0,0 +1,108 @@
+from django.db import connections, router, transaction
+from django.db.models.signals import post_delete, post_save
+
+
+def quoted(model, *fields):
+    """Quoted table name, primary key column and `fields` columns."""
+    quote = connections[router.db_for_write(model)].ops.quote_name
+    return (
+        quote(model._meta.db_table),
+        quote(model._meta.pk.column),
+        *(quote(model._meta.get_field(field).column) for field in fields),
+    )
+
+
+def insert_links(model, owner_field, owner_id, target_field, target_ids,
+                 exclude_self=False):
+    """Insert missing (owner, target) links for every existing target.
+
+    `INSERT ... SELECT ... ON CONFLICT DO NOTHING RETURNING` only inserts
+    when the target exists and the link does not, so concurrent identical
+    requests cannot trip the unique constraint, and only the rows this
+    statement wrote are reported. `exclude_self` also skips links from
+    an owner to itself. Returns (pk, target_id) pairs of the new rows.
+    """
+    target_model = model._meta.get_field(target_field).related_model
+    table, pk, owner, target = quoted(model, owner_field, target_field)
+    target_table, target_pk = quoted(target_model)
+
+    condition = f'{target_pk} IN ({", ".join(["%s"] * len(target_ids))})'
+    params = [owner_id, *target_ids]
+    if exclude_self:
+        condition += f' AND {target_pk} <> %s'
+        params.append(owner_id)
+
+    with connections[router.db_for_write(model)].cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {table} ({owner}, {target}) '
+            f'SELECT %s, {target_pk} FROM {target_table} WHERE {condition} '
+            f'ON CONFLICT DO NOTHING RETURNING {pk}, {target}',
+            params,
+        )
+        return cursor.fetchall()
+
+
+def remove_links(model, owner_field, owner_id, target_field, target_ids):
+    """Delete (owner, target) links with `DELETE ... RETURNING`.
+
+    Returns (pk, target_id) pairs of the rows this statement deleted.
+    """
+    table, pk, owner, target = quoted(model, owner_field, target_field)
+
+    with connections[router.db_for_write(model)].cursor() as cursor:
+        cursor.execute(
+            f'DELETE FROM {table} WHERE {owner} = %s AND {target} IN '
+            f'({", ".join(["%s"] * len(target_ids))}) '
+            f'RETURNING {pk}, {target}',
+            [owner_id, *target_ids],
+        )
+        return cursor.fetchall()
+
+
+@transaction.atomic
+def create_link(model, owner_field, owner_id, target_field, target_id,
+                exclude_self=False):
+    """Insert an (owner, target) link row with a single statement.
+
+    The row is written without the ORM, so `post_save` is sent here.
+    Returns the new instance, or None when nothing was inserted.
+    """
+    rows = insert_links(
+        model, owner_field, owner_id, target_field, [target_id],
+        exclude_self,
+    )
+    if not rows:
+        return None
+
+    using = router.db_for_write(model)
+    instance = model(pk=rows[0][0], **{
+        f'{owner_field}_id': owner_id, f'{target_field}_id': target_id,
+    })
+    instance._state.adding = False
+    instance._state.db = using
+    post_save.send(
+        sender=model, instance=instance, created=True,
+        update_fields=None, raw=False, using=using,
+    )
+    return instance
+
+
+@transaction.atomic
+def delete_link(model, owner_field, owner_id, target_field, target_id):
+    """Delete an (owner, target) link with a single statement.
+
+    Returns whether a row was deleted; `post_delete` is sent for it.
+    """
+    rows = remove_links(
+        model, owner_field, owner_id, target_field, [target_id]
+    )
+
+    using = router.db_for_write(model)
+    for deleted_pk, _ in rows:
+        instance = model(pk=deleted_pk, **{
+            f'{owner_field}_id': owner_id, f'{target_field}_id': target_id,
+        })
+        instance._state.db = using
+        post_delete.send(sender=model, instance=instance, using=using)
+
+    return bool(rows)
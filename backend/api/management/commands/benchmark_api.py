@@ -0,0 +1,404 @@
+import json
+import random
+import time
+import tracemalloc
+
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from rest_framework.pagination import Cursor
+from rest_framework.test import APIClient
+
+from recipes.models import Ingredient, Recipe, Tag
+from recipes.thumbnails import wait_for_thumbnails
+
+from ...paginations import RecipeCursorPagination
+
+User = get_user_model()
+
+BATCH_SIZE = 20
+
+PNG = (
+    'data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAAAEAAAABAQMAAAAl21bKAAAAA1'
+    'BMVEUAAACnej3aAAAAAXRSTlMAQObYZgAAAApJREFUCNdjYAAAAAIAAeIhvDMAAAAASUVORK5'
+    'CYII='
+)
+
+
+class QueryCounter:
+    """Database execute wrapper counting statements and their total time."""
+
+    def __init__(self):
+        self.count = 0
+        self.elapsed = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.elapsed += time.perf_counter() - started
+            self.count += 1
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+class Command(BaseCommand):
+    """Benchmark every endpoint of `api/urls.py` through the test client.
+
+    Each scenario is one request. Write scenarios are wrapped in steps
+    that undo them (subscribe and unsubscribe, create and delete), so the
+    database ends up as it started. Latency and query counts are measured
+    on every iteration; peak Python memory is traced on one extra run, as
+    tracing would distort the timings.
+    """
+    help = 'Report latency, SQL queries and peak memory per API endpoint.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=50)
+        parser.add_argument('--warmup', type=int, default=3)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument(
+            '--password',
+            default='synthetic-password',
+            help='Password of the generated users, for the auth endpoints.',
+        )
+        parser.add_argument(
+            '--only',
+            default='',
+            help='Run only scenarios whose name contains this text.',
+        )
+        parser.add_argument(
+            '--cold',
+            action='store_true',
+            help='Clear the response cache before every request.',
+        )
+        parser.add_argument(
+            '--json',
+            action='store_true',
+            help='Print the results as JSON instead of a table.',
+        )
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options['seed'])
+        self.password = options['password']
+        self.prepare()
+
+        results = []
+        for name, setup, run, teardown in self.scenarios():
+            if options['only'] not in name:
+                continue
+            results.append(
+                self.measure(name, setup, run, teardown, options)
+            )
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+
+        self.stdout.write(
+            f'{"scenario":<48}{"status":>7}{"p50 ms":>9}{"p90 ms":>9}'
+            f'{"p99 ms":>9}{"max ms":>9}{"queries":>9}{"sql ms":>9}'
+            f'{"peak KiB":>10}'
+        )
+        for result in results:
+            self.stdout.write(
+                f'{result["scenario"]:<48}{result["status"]:>7}'
+                f'{result["p50_ms"]:>9.2f}{result["p90_ms"]:>9.2f}'
+                f'{result["p99_ms"]:>9.2f}{result["max_ms"]:>9.2f}'
+                f'{result["queries"]:>9.1f}{result["sql_ms"]:>9.2f}'
+                f'{result["peak_kib"]:>10.1f}'
+            )
+        self.stdout.write(self.style.SUCCESS(
+            f'{len(results)} scenarios benchmarked on {connection.vendor}.')
+        )
+
+    def prepare(self):
+        authors = User.objects.annotate(
+            published=Count('recipes')
+        ).filter(published__gt=0).order_by('-published')
+        self.user = authors.first()
+        if self.user is None or not Tag.objects.exists():
+            raise CommandError(
+                'The database has no recipes to benchmark, '
+                'run generate_dataset first.'
+            )
+
+        self.author = self.random.choice(list(authors[:20]))
+        self.other = User.objects.exclude(
+            pk=self.user.pk
+        ).exclude(subscription_author__user=self.user).first()
+        self.recipe = Recipe.objects.exclude(
+            favorite__user=self.user
+        ).exclude(cart__user=self.user).order_by('?').first()
+        self.batch = list(Recipe.objects.exclude(
+            favorite__user=self.user
+        ).exclude(cart__user=self.user).exclude(
+            pk=self.recipe.pk
+        ).order_by('?').values_list('id', flat=True)[:BATCH_SIZE])
+        self.tags = list(Tag.objects.values_list('id', flat=True)[:2])
+        self.tag_slug = Tag.objects.values_list('slug', flat=True).first()
+        self.ingredients = list(
+            Ingredient.objects.values_list('id', flat=True)[:5]
+        )
+        self.ingredient = Ingredient.objects.order_by('?').first()
+        self.created = self.token = None
+
+        self.anonymous = APIClient()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def recipe_payload(self):
+        return {
+            'name': 'Benchmark soup',
+            'text': 'Boil everything.',
+            'cooking_time': 10,
+            'image': PNG,
+            'tags': self.tags,
+            'ingredients': [
+                {'id': ingredient_id, 'amount': 10}
+                for ingredient_id in self.ingredients
+            ],
+        }
+
+    def create_recipe(self):
+        response = self.client.post(
+            '/api/recipes/', self.recipe_payload(), format='json'
+        )
+        self.created = response.data.get('id')
+        return response
+
+    def delete_recipe(self):
+        return self.client.delete(f'/api/recipes/{self.created}/')
+
+    def create_user(self):
+        return self.anonymous.post('/api/users/', {
+            'email': 'benchmark@example.com',
+            'username': 'benchmark',
+            'first_name': 'Bench',
+            'last_name': 'Mark',
+            'password': self.password,
+        }, format='json')
+
+    def delete_user(self):
+        User.objects.filter(username='benchmark').delete()
+
+    def login(self):
+        response = self.anonymous.post('/api/auth/token/login/', {
+            'email': self.user.email, 'password': self.password,
+        }, format='json')
+        self.token = response.data.get('auth_token')
+        return response
+
+    def logout(self):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Token {self.token}')
+        return client.post('/api/auth/token/logout/')
+
+    def deep_pages(self, pages, limit):
+        """Yield (page, path) of `?page=N` and of the cursor of page N.
+
+        The cursor points after the last recipe of page N - 1, so both
+        paths return the same recipes and differ only in OFFSET versus a
+        keyset seek. Pages past the end of the dataset are skipped.
+        """
+        paginator = RecipeCursorPagination()
+        paginator.base_url = f'recipes/?limit={limit}'
+        ordered = Recipe.objects.order_by(*paginator.ordering)
+        for page in pages:
+            last = ordered[(page - 1) * limit - 1:(page - 1) * limit].first()
+            if last is None:
+                continue
+            position = paginator._get_position_from_instance(
+                last, paginator.ordering
+            )
+            yield page, paginator.encode_cursor(
+                Cursor(offset=0, reverse=False, position=position)
+            )
+
+    def scenarios(self):
+        """Return (name, setup, request, teardown) tuples.
+
+        Only the request is measured. Setup and teardown bring the
+        database to the state the request needs and back, so every write
+        endpoint can be repeated and the data is left as it was found.
+        """
+        anonymous, client = self.anonymous, self.client
+        recipe, author = self.recipe.pk, self.author.pk
+        tag = self.tags[0]
+        query = self.ingredient.name[:3]
+
+        def get(path, user=client):
+            name = f'GET {path}'
+            if user is anonymous:
+                name += ' (anonymous)'
+            return (name, None, lambda: user.get(f'/api/{path}'), None)
+
+        subscribe = f'/api/users/{self.other.pk}/subscribe/'
+        favorite = f'/api/recipes/{recipe}/favorite/'
+        cart = f'/api/recipes/{recipe}/shopping_cart/'
+
+        def batch(endpoint, method):
+            path = f'/api/recipes/{endpoint}/'
+            payload = {'recipes': self.batch}
+            return lambda: getattr(client, method)(
+                path, payload, format='json'
+            )
+
+        deep_pages = []
+        for page, cursor in self.deep_pages((50, 500), 6):
+            deep_pages += [
+                get(f'recipes/?page={page}&limit=6'),
+                (f'GET recipes/?limit=6&cursor=<page {page}>', None,
+                 lambda cursor=cursor: client.get(f'/api/{cursor}'), None),
+            ]
+
+        return [
+            get('users/?page=1&limit=6', anonymous),
+            get(f'users/{author}/'),
+            get('users/me/'),
+            get('users/subscriptions/?limit=6&recipes_limit=3'),
+            get('recipes/feed/?limit=6'),
+            ('POST users/', None, self.create_user, self.delete_user),
+            ('POST users/set_password/', None,
+             lambda: client.post('/api/users/set_password/', {
+                 'current_password': self.password,
+                 'new_password': self.password,
+             }, format='json'),
+             None),
+            ('POST auth/token/login/', None, self.login, self.logout),
+            ('POST auth/token/logout/', self.login, self.logout, None),
+            ('POST users/{id}/subscribe/', None,
+             lambda: client.post(subscribe),
+             lambda: client.delete(subscribe)),
+            ('DELETE users/{id}/subscribe/',
+             lambda: client.post(subscribe),
+             lambda: client.delete(subscribe),
+             None),
+            get('tags/', anonymous),
+            get(f'tags/{tag}/', anonymous),
+            get('ingredients/', anonymous),
+            get(f'ingredients/?name={query}', anonymous),
+            get(f'ingredients/{self.ingredient.pk}/', anonymous),
+            get('recipes/?page=1&limit=6', anonymous),
+            get('recipes/?page=1&limit=6'),
+            get('recipes/?pagination=cursor&limit=6'),
+            *deep_pages,
+            get(f'recipes/?limit=6&tags={self.tag_slug}'),
+            get(f'recipes/?limit=6&author={author}'),
+            get('recipes/?limit=6&is_favorited=1'),
+            get('recipes/?limit=6&is_in_shopping_cart=1'),
+            get('recipes/?limit=6&search=soup'),
+            get('recipes/?limit=6&ordering=popular'),
+            get('recipes/?limit=6&ordering=trending'),
+            get(f'recipes/{recipe}/', anonymous),
+            get(f'recipes/{recipe}/'),
+            ('POST recipes/', None,
+             self.create_recipe,
+             self.delete_recipe),
+            ('PATCH recipes/{id}/', self.create_recipe,
+             lambda: client.patch(
+                 f'/api/recipes/{self.created}/', self.recipe_payload(),
+                 format='json'),
+             self.delete_recipe),
+            ('DELETE recipes/{id}/',
+             self.create_recipe,
+             self.delete_recipe,
+             None),
+            ('POST recipes/{id}/favorite/', None,
+             lambda: client.post(favorite),
+             lambda: client.delete(favorite)),
+            ('DELETE recipes/{id}/favorite/',
+             lambda: client.post(favorite),
+             lambda: client.delete(favorite),
+             None),
+            ('POST recipes/{id}/shopping_cart/', None,
+             lambda: client.post(cart),
+             lambda: client.delete(cart)),
+            ('DELETE recipes/{id}/shopping_cart/',
+             lambda: client.post(cart),
+             lambda: client.delete(cart),
+             None),
+            (f'POST recipes/favorite/ ({BATCH_SIZE} recipes)', None,
+             batch('favorite', 'post'),
+             batch('favorite', 'delete')),
+            (f'DELETE recipes/favorite/ ({BATCH_SIZE} recipes)',
+             batch('favorite', 'post'),
+             batch('favorite', 'delete'),
+             None),
+            (f'POST recipes/shopping_cart/ ({BATCH_SIZE} recipes)', None,
+             batch('shopping_cart', 'post'),
+             batch('shopping_cart', 'delete')),
+            (f'DELETE recipes/shopping_cart/ ({BATCH_SIZE} recipes)',
+             batch('shopping_cart', 'post'),
+             batch('shopping_cart', 'delete'),
+             None),
+            ('GET recipes/download_shopping_cart/',
+             lambda: client.post(cart),
+             lambda: b''.join(client.get(
+                 '/api/recipes/download_shopping_cart/').streaming_content),
+             lambda: client.delete(cart)),
+        ]
+
+    def run_once(self, setup, run, teardown, options):
+        """Run one measured request, letting background thumbnail work
+        finish outside of the measurement."""
+        if setup is not None:
+            setup()
+        wait_for_thumbnails()
+        if options['cold']:
+            caches['responses'].clear()
+
+        queries = QueryCounter()
+        with connection.execute_wrapper(queries):
+            started = time.perf_counter()
+            response = run()
+            elapsed = (time.perf_counter() - started) * 1000
+
+        wait_for_thumbnails()
+        if teardown is not None:
+            teardown()
+        return response, elapsed, queries
+
+    def measure(self, name, setup, run, teardown, options):
+        for _ in range(options['warmup']):
+            self.run_once(setup, run, teardown, options)
+
+        timings, queries, sql_time, status = [], [], [], None
+        for _ in range(options['iterations']):
+            response, elapsed, counter = self.run_once(
+                setup, run, teardown, options
+            )
+            timings.append(elapsed)
+            queries.append(counter.count)
+            sql_time.append(counter.elapsed * 1000)
+            status = getattr(response, 'status_code', 200)
+
+        if setup is not None:
+            setup()
+        wait_for_thumbnails()
+        tracemalloc.start()
+        run()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        wait_for_thumbnails()
+        if teardown is not None:
+            teardown()
+
+        return {
+            'scenario': name,
+            'status': status,
+            'iterations': len(timings),
+            'p50_ms': percentile(timings, 0.5),
+            'p90_ms': percentile(timings, 0.9),
+            'p99_ms': percentile(timings, 0.99),
+            'max_ms': max(timings),
+            'queries': sum(queries) / len(queries),
+            'sql_ms': sum(sql_time) / len(sql_time),
+            'peak_kib': peak / 1024,
+        }
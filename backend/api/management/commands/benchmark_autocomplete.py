@@ -0,0 +1,148 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from rest_framework.filters import SearchFilter
+from rest_framework.test import APIRequestFactory
+from rest_framework.viewsets import ReadOnlyModelViewSet
+
+from recipes.management.commands.generate_dataset import UNITS, WORDS
+from recipes.models import Ingredient
+
+from ...autocomplete import IngredientIndex, ingredient_index
+from ...filters import IngredientAutocompleteFilter
+from ...serializers import IngredientSerializer
+
+
+class IngredientNameSearchFilter(SearchFilter):
+    """The `icontains` filter `/api/ingredients/` used before the index."""
+    search_param = 'name'
+
+
+class IcontainsIngredientViewSet(ReadOnlyModelViewSet):
+    queryset = Ingredient.objects.all()
+    serializer_class = IngredientSerializer
+    filter_backends = (IngredientNameSearchFilter,)
+    search_fields = ('name',)
+
+
+class IndexIngredientViewSet(ReadOnlyModelViewSet):
+    queryset = Ingredient.objects.all()
+    serializer_class = IngredientSerializer
+    filter_backends = (IngredientAutocompleteFilter,)
+
+
+class Command(BaseCommand):
+    """Compare the autocomplete index with the old `icontains` search.
+
+    A synthetic catalog of `--ingredients` names is inserted in a
+    transaction that is rolled back at the end, so the database is left
+    as it was. Both views are identical apart from the filter backend and
+    skip the response cache, so every request reaches the database. The
+    index must return the same number of rows as `icontains` (up to its
+    limit), and every row it returns must also be matched by `icontains`.
+    """
+    help = 'Benchmark /api/ingredients/?name= against the icontains path.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ingredients', type=int, default=100000)
+        parser.add_argument('--queries', type=int, default=200)
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options['seed'])
+        with transaction.atomic():
+            self.create_catalog(options['ingredients'])
+            try:
+                self.compare(options['queries'])
+            finally:
+                transaction.set_rollback(True)
+        # The index may still hold the rolled back names.
+        IngredientIndex.invalidate()
+
+    def create_catalog(self, count):
+        Ingredient.objects.bulk_create(
+            (
+                Ingredient(
+                    name=(
+                        f'{self.random.choice(WORDS)} '
+                        f'{self.random.choice(WORDS)} {number}'
+                    ),
+                    measurement_unit=self.random.choice(UNITS),
+                )
+                for number in range(count)
+            ),
+            batch_size=1000,
+        )
+        self.stdout.write(
+            f'{Ingredient.objects.count()} ingredients on {connection.vendor}.'
+        )
+
+    def make_queries(self, count):
+        """Prefixes and inner substrings of 1 to 5 characters."""
+        queries = []
+        for _ in range(count):
+            word = self.random.choice(WORDS)
+            length = self.random.randint(1, min(5, len(word)))
+            start = self.random.choice(
+                (0, self.random.randint(0, len(word) - length))
+            )
+            queries.append(word[start:start + length])
+        return queries
+
+    def compare(self, count):
+        started = time.perf_counter()
+        ingredient_index.build(ingredient_index.current_version())
+        self.stdout.write(
+            f'Index built in {(time.perf_counter() - started) * 1000:.0f} ms.'
+        )
+
+        factory = APIRequestFactory()
+        paths = (
+            ('icontains', IcontainsIngredientViewSet.as_view({'get': 'list'})),
+            ('index', IndexIngredientViewSet.as_view({'get': 'list'})),
+        )
+        timings = {name: [] for name, _ in paths}
+        rows = {name: [] for name, _ in paths}
+
+        for query in self.make_queries(count):
+            results = {}
+            for name, view in paths:
+                request = factory.get('/api/ingredients/', {'name': query})
+                started = time.perf_counter()
+                response = view(request)
+                response.render()
+                timings[name].append(time.perf_counter() - started)
+                results[name] = {item['id'] for item in response.data}
+                rows[name].append(len(response.data))
+
+            limit = IngredientAutocompleteFilter.max_results
+            if (
+                not results['index'] <= results['icontains']
+                or len(results['index'])
+                != min(limit, len(results['icontains']))
+            ):
+                self.stderr.write(f'Results differ for {query!r}.')
+
+        self.stdout.write(
+            f'{"path":<12}{"queries":>9}{"rows":>10}'
+            f'{"p50 ms":>10}{"p90 ms":>10}{"max ms":>10}'
+        )
+        for name, _ in paths:
+            values = sorted(timings[name])
+            self.stdout.write(
+                f'{name:<12}{len(values):>9}'
+                f'{statistics.mean(rows[name]):>10.0f}'
+                f'{statistics.median(values) * 1000:>10.2f}'
+                f'{values[int(len(values) * 0.9)] * 1000:>10.2f}'
+                f'{values[-1] * 1000:>10.2f}'
+            )
+        speedup = (
+            statistics.median(timings['icontains'])
+            / statistics.median(timings['index'])
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f'The index is {speedup:.1f}x faster at the median.'
+        ))
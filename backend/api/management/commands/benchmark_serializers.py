@@ -0,0 +1,105 @@
+import statistics
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from recipes.models import Ingredient, Tag
+
+from ...renderers import ORJSONRenderer
+from ...serializers import (FastRepresentationMixin, IngredientSerializer,
+                            RecipeDetailSerializer, TagSerializer,
+                            UserDataSerializer)
+from ...views import RecipeViewSet
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    """Compare DRF's generic serializer path with the hand-built one.
+
+    Both paths serialize the same prefetched objects, and the rendered
+    bytes are checked to be identical before any timing is reported.
+    Times are medians over `--repeat` runs, scaled to 1,000 objects.
+    """
+    help = 'Benchmark serializer and renderer time per 1,000 objects.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=1000)
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        user = User.objects.annotate(
+            subscriptions=Count('subscription_user')
+        ).order_by('-subscriptions').first()
+        if user is None:
+            raise CommandError(
+                'The database is empty, run generate_dataset first.'
+            )
+
+        request = Request(APIRequestFactory().get('/api/recipes/'))
+        request.user = user
+        view = RecipeViewSet(action='list', request=request, format_kwarg=None)
+        count = options['count']
+
+        cases = (
+            ('recipes', RecipeDetailSerializer,
+             list(view.get_queryset()[:count])),
+            ('ingredients', IngredientSerializer,
+             list(Ingredient.objects.all()[:count])),
+            ('tags', TagSerializer, list(Tag.objects.all()[:count])),
+            ('users', UserDataSerializer, list(User.objects.all()[:count])),
+        )
+
+        self.stdout.write(
+            f'{"serializer":<14}{"objects":>8}{"drf ms":>10}{"fast ms":>10}'
+            f'{"json ms":>10}{"orjson ms":>11}{"speedup":>9}'
+        )
+        for name, serializer_class, objects in cases:
+            if not objects:
+                continue
+            self.compare(
+                name, serializer_class, objects, request, options['repeat']
+            )
+
+    def measure(self, function, repeat):
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            result = function()
+            timings.append(time.perf_counter() - started)
+        return result, statistics.median(timings) * 1000
+
+    def compare(self, name, serializer_class, objects, request, repeat):
+        def serialize():
+            return serializer_class(
+                objects, many=True, context={'request': request}
+            ).data
+
+        try:
+            FastRepresentationMixin.fast_representation = False
+            generic, generic_ms = self.measure(serialize, repeat)
+        finally:
+            FastRepresentationMixin.fast_representation = True
+        fast, fast_ms = self.measure(serialize, repeat)
+
+        expected, json_ms = self.measure(
+            lambda: JSONRenderer().render(generic), repeat
+        )
+        rendered, orjson_ms = self.measure(
+            lambda: ORJSONRenderer().render(fast), repeat
+        )
+        if rendered != expected:
+            raise CommandError(f'{name}: the fast output differs from DRF.')
+
+        scale = 1000 / len(objects)
+        self.stdout.write(
+            f'{name:<14}{len(objects):>8}{generic_ms * scale:>10.2f}'
+            f'{fast_ms * scale:>10.2f}{json_ms * scale:>10.2f}'
+            f'{orjson_ms * scale:>11.2f}'
+            f'{(generic_ms + json_ms) / (fast_ms + orjson_ms):>8.1f}x'
+        )
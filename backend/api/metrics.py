@@ -0,0 +1,189 @@
+import hmac
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from contextlib import ExitStack
+from threading import Lock
+
+from django.conf import settings
+from django.db import connections
+from django.http import HttpResponse, HttpResponseForbidden
+
+from .cache import response_cache
+
+DURATION_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10,
+)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 200)
+
+
+class Histogram:
+    """Per-bucket counts, made cumulative only when exported."""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.total += value
+
+    def export(self, name, labels):
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            yield f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}'
+        cumulative += self.counts[-1]
+        yield f'{name}_bucket{{{labels},le="+Inf"}} {cumulative}'
+        yield f'{name}_sum{{{labels}}} {self.total}'
+        yield f'{name}_count{{{labels}}} {cumulative}'
+
+
+class RequestMetrics:
+    """In-process request histograms labelled by endpoint and method.
+
+    Each observation is a few list increments under one lock; all the
+    formatting work happens when the metrics are scraped.
+    """
+    histograms = (
+        ('foodgram_request_duration_seconds',
+         'Request latency.', DURATION_BUCKETS),
+        ('foodgram_request_sql_queries',
+         'SQL statements per request.', QUERY_BUCKETS),
+        ('foodgram_request_sql_duration_seconds',
+         'Time spent in SQL per request.', DURATION_BUCKETS),
+    )
+
+    def __init__(self):
+        self.lock = Lock()
+        self.series = {}
+        self.responses = defaultdict(int)
+
+    def observe(self, endpoint, method, status, duration, queries,
+                sql_duration):
+        key = (endpoint, method)
+        with self.lock:
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = [
+                    Histogram(buckets) for _, _, buckets in self.histograms
+                ]
+            series[0].observe(duration)
+            series[1].observe(queries)
+            series[2].observe(sql_duration)
+            self.responses[(endpoint, method, status)] += 1
+
+    def export(self):
+        with self.lock:
+            series = {
+                key: [
+                    (list(histogram.counts), histogram.total)
+                    for histogram in histograms
+                ]
+                for key, histograms in self.series.items()
+            }
+            responses = dict(self.responses)
+
+        lines = []
+        for index, (name, description, buckets) in enumerate(
+            self.histograms
+        ):
+            lines.append(f'# HELP {name} {description}')
+            lines.append(f'# TYPE {name} histogram')
+            for (endpoint, method), values in sorted(series.items()):
+                histogram = Histogram(buckets)
+                histogram.counts, histogram.total = values[index]
+                lines.extend(histogram.export(
+                    name, f'endpoint="{endpoint}",method="{method}"'
+                ))
+
+        lines.append('# HELP foodgram_responses_total Responses by status.')
+        lines.append('# TYPE foodgram_responses_total counter')
+        for (endpoint, method, status), count in sorted(responses.items()):
+            lines.append(
+                f'foodgram_responses_total{{endpoint="{endpoint}",'
+                f'method="{method}",status="{status}"}} {count}'
+            )
+
+        lines.append(
+            '# HELP foodgram_response_cache_events_total '
+            'Response cache hits, misses and invalidations.'
+        )
+        lines.append('# TYPE foodgram_response_cache_events_total counter')
+        for event, count in sorted(response_cache.stats.items()):
+            lines.append(
+                f'foodgram_response_cache_events_total{{event="{event}"}} '
+                f'{count}'
+            )
+
+        return '\n'.join(lines) + '\n'
+
+
+request_metrics = RequestMetrics()
+
+
+class QueryTimer:
+    def __init__(self):
+        self.count = 0
+        self.elapsed = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.elapsed += time.perf_counter() - started
+            self.count += 1
+
+
+class RequestMetricsMiddleware:
+    """Record latency and SQL usage of every request.
+
+    Requests are labelled with the URL name of the route they matched,
+    which for DRF routers is the viewset basename and action, such as
+    `recipes-list` or `users-subscriptions`.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        timer = QueryTimer()
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(timer))
+            response = self.get_response(request)
+        duration = time.perf_counter() - started
+
+        match = getattr(request, 'resolver_match', None)
+        request_metrics.observe(
+            match.url_name or match.view_name if match else 'unmatched',
+            request.method,
+            response.status_code,
+            duration,
+            timer.count,
+            timer.elapsed,
+        )
+        return response
+
+
+def metrics_view(request):
+    """Prometheus text exposition of `request_metrics`.
+
+    Only staff users and scrapers sending `METRICS_TOKEN` as a bearer
+    token may read it. Without a token configured only staff can.
+    """
+    token = settings.METRICS_TOKEN
+    authorization = request.headers.get('Authorization', '').encode()
+    expected = f'Bearer {token}'.encode()
+    if not (
+        token and hmac.compare_digest(authorization, expected)
+    ) and not request.user.is_staff:
+        return HttpResponseForbidden()
+
+    return HttpResponse(
+        request_metrics.export(),
+        content_type='text/plain; version=0.0.4; charset=utf-8',
+    )
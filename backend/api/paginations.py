@@ -1,5 +1,146 @@
-from rest_framework.pagination import PageNumberPagination
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import (Cursor, CursorPagination,
+                                       PageNumberPagination)
 
 
 class PageLimitPagination(PageNumberPagination):
     page_size_query_param = 'limit'
+
+
+class RecipeCursorPagination(CursorPagination):
+    """Keyset pagination over recipes ordered by (-pub_date, -id).
+
+    Each page is a single indexed range scan starting after the last
+    (pub_date, id) pair of the previous page, and no COUNT is issued, so
+    every page costs the same no matter how deep it is.
+    """
+    page_size = 6
+    page_size_query_param = 'limit'
+    max_page_size = 100
+    ordering = ('-pub_date', '-id')
+    id_field = 'id'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.base_url = request.build_absolute_uri()
+        self.cursor = self.decode_cursor(request)
+
+        reverse = bool(self.cursor and self.cursor.reverse)
+        if reverse:
+            queryset = queryset.order_by('pub_date', self.id_field)
+        else:
+            queryset = queryset.order_by(*self.ordering)
+
+        position = self.cursor.position if self.cursor else None
+        if position is not None:
+            pub_date, pk = self.parse_position(position)
+            lookup = 'gt' if reverse else 'lt'
+            queryset = queryset.filter(
+                Q(**{f'pub_date__{lookup}': pub_date})
+                | Q(pub_date=pub_date, **{f'{self.id_field}__{lookup}': pk})
+            )
+
+        results = list(queryset[:self.page_size + 1])
+        has_following = len(results) > self.page_size
+        self.page = results[:self.page_size]
+        if reverse:
+            self.page.reverse()
+
+        if reverse:
+            self.has_next = position is not None
+            self.has_previous = has_following
+        else:
+            self.has_next = has_following
+            self.has_previous = position is not None
+
+        if self.page:
+            self.next_position = self._get_position_from_instance(
+                self.page[-1], self.ordering
+            )
+            self.previous_position = self._get_position_from_instance(
+                self.page[0], self.ordering
+            )
+        else:
+            self.next_position = self.previous_position = position
+
+        return self.page
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        return self.encode_cursor(
+            Cursor(offset=0, reverse=False, position=self.next_position)
+        )
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        return self.encode_cursor(
+            Cursor(offset=0, reverse=True, position=self.previous_position)
+        )
+
+    def _get_position_from_instance(self, instance, ordering):
+        return (
+            f'{instance.pub_date.isoformat()}_'
+            f'{getattr(instance, self.id_field)}'
+        )
+
+    def parse_position(self, position):
+        pub_date, _, pk = position.rpartition('_')
+        pub_date = parse_datetime(pub_date)
+
+        if pub_date is None or not pk.isdigit():
+            raise NotFound(self.invalid_cursor_message)
+
+        return pub_date, int(pk)
+
+
+class FeedCursorPagination(RecipeCursorPagination):
+    """Keyset pagination over feed entries ordered by (-pub_date, -recipe).
+
+    Within one user the order matches the recipe order, so a page is a
+    range scan of the feed index.
+    """
+    ordering = ('-pub_date', '-recipe_id')
+    id_field = 'recipe_id'
+
+
+class RecipePagination(PageLimitPagination):
+    """Page-number pagination with an opt-in keyset mode.
+
+    Passing `pagination=cursor` (or a `cursor` issued by a previous page)
+    switches to `RecipeCursorPagination`, which skips the COUNT query and
+    replaces OFFSET with a seek on (pub_date, id).
+    """
+    mode_query_param = 'pagination'
+    cursor_paginator = None
+
+    def use_cursor(self, request):
+        # The keyset only follows the default newest-first order.
+        if request.query_params.get('ordering', 'newest') != 'newest':
+            return False
+
+        return (
+            request.query_params.get(self.mode_query_param) == 'cursor'
+            or RecipeCursorPagination.cursor_query_param
+            in request.query_params
+        )
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.use_cursor(request):
+            self.cursor_paginator = RecipeCursorPagination()
+            return self.cursor_paginator.paginate_queryset(
+                queryset, request, view
+            )
+
+        self.cursor_paginator = None
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.cursor_paginator is not None:
+            return self.cursor_paginator.get_paginated_response(data)
+
+        return super().get_paginated_response(data)
@@ -0,0 +1,129 @@
+import csv
+import json
+
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class ORJSONRenderer(JSONRenderer):
+    """JSON renderer backed by orjson, with `JSONRenderer`'s exact output.
+
+    Dates and dataclasses go through DRF's encoder so they are formatted
+    the same way. Indented output, ASCII-only output and installs without
+    orjson fall back to the standard renderer.
+    """
+    options = (
+        orjson.OPT_NON_STR_KEYS
+        | orjson.OPT_PASSTHROUGH_DATETIME
+        | orjson.OPT_PASSTHROUGH_DATACLASS
+    ) if orjson else 0
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if (orjson is None or data is None or self.ensure_ascii
+                or not self.compact or self.get_indent(
+                    accepted_media_type, renderer_context or {}
+                ) is not None):
+            return super().render(
+                data, accepted_media_type, renderer_context
+            )
+
+        return orjson.dumps(
+            data, default=self.encoder_class().default, option=self.options
+        ).replace(
+            '\u2028'.encode(), b'\\u2028'
+        ).replace(
+            '\u2029'.encode(), b'\\u2029'
+        )
+
+
+class EchoBuffer:
+    """File-like object that hands back whatever is written to it."""
+
+    @staticmethod
+    def write(value):
+        return value
+
+
+class ShoppingListRenderer(BaseRenderer):
+    """Base renderer for the downloadable shopping list.
+
+    `stream` yields the list chunk by chunk from an iterator of aggregated
+    ingredient rows, so the whole document never has to be held in memory.
+    `render` is only used for responses that are not streamed, such as
+    errors and empty carts.
+    """
+    charset = 'utf-8'
+
+    def stream(self, ingredients, user):
+        raise NotImplementedError
+
+    def render_error(self, data):
+        return str(data.get('detail', data))
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+
+        if isinstance(data, dict):
+            return self.render_error(data).encode(self.charset)
+
+        user = renderer_context['request'].user
+        return ''.join(self.stream(data, user)).encode(self.charset)
+
+    @staticmethod
+    def as_item(ingredient):
+        return (
+            ingredient['ingredient__name'],
+            ingredient['ingredient_value'],
+            ingredient['ingredient__measurement_unit'],
+        )
+
+
+class ShoppingListTextRenderer(ShoppingListRenderer):
+    media_type = 'text/plain'
+    format = 'txt'
+
+    def stream(self, ingredients, user):
+        yield f'Foodgram user {user} - shopping list\n\n'
+
+        for ingredient in ingredients:
+            name, amount, measurement_unit = self.as_item(ingredient)
+            yield f'• {name} - {amount} {measurement_unit}\n'
+
+
+class ShoppingListCSVRenderer(ShoppingListRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+
+    def stream(self, ingredients, user):
+        writer = csv.writer(EchoBuffer())
+        yield writer.writerow(('name', 'amount', 'measurement_unit'))
+
+        for ingredient in ingredients:
+            yield writer.writerow(self.as_item(ingredient))
+
+
+class ShoppingListJSONRenderer(ShoppingListRenderer):
+    media_type = 'application/json'
+    format = 'json'
+
+    def render_error(self, data):
+        return json.dumps(data)
+
+    def stream(self, ingredients, user):
+        separator = '['
+
+        for ingredient in ingredients:
+            name, amount, measurement_unit = self.as_item(ingredient)
+            yield separator + json.dumps({
+                'name': name,
+                'amount': amount,
+                'measurement_unit': measurement_unit,
+            }, ensure_ascii=False)
+            separator = ','
+
+        yield '[]' if separator == '[' else ']'
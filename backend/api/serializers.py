@@ -1,19 +1,57 @@
 from django.contrib.auth import get_user_model
+from django.db import transaction
 from djoser.serializers import UserCreateSerializer, UserSerializer
-from drf_extra_fields.fields import Base64ImageField
-from rest_framework.serializers import (IntegerField, ModelSerializer,
-                                        PrimaryKeyRelatedField, ReadOnlyField,
-                                        SerializerMethodField)
+from rest_framework.serializers import (IntegerField, ListField,
+                                        ModelSerializer, ReadOnlyField,
+                                        Serializer, SerializerMethodField)
 from rest_framework.validators import ValidationError
 
 from users.models import Subscription
 from recipes.models import (Favorite, Ingredient, IngredientInRecipe, Recipe,
-                            ShoppingCart, Tag)
+                            ShoppingCart, ShoppingCartIngredient, Tag)
+from recipes.thumbnails import discard_thumbnails, schedule_thumbnails
+
+from .cache import get_recipe_sets
+from .fields import (RecipeThumbnailsField, StreamingBase64ImageField,
+                     file_url, thumbnail_urls)
 
 User = get_user_model()
 
 
-class TagSerializer(ModelSerializer):
+def get_followed_author_ids(request):
+    """Return IDs of the authors the requesting user is subscribed to.
+
+    The set is loaded once and cached on the request, so every serializer
+    rendering users for this request shares a single query.
+    """
+    if not hasattr(request, 'followed_author_ids'):
+        request.followed_author_ids = set(
+            Subscription.objects.filter(
+                user=request.user
+            ).values_list('author_id', flat=True)
+        )
+
+    return request.followed_author_ids
+
+
+class FastRepresentationMixin:
+    """Build the output dict by hand instead of through the field objects.
+
+    Read-heavy serializers define `represent`, which must return exactly
+    what the declared fields would, in the same order. Setting
+    `fast_representation` to False, on one serializer or on the mixin,
+    falls back to DRF's generic path, which `benchmark_serializers`
+    compares against.
+    """
+    fast_representation = True
+
+    def to_representation(self, instance):
+        if not self.fast_representation:
+            return super().to_representation(instance)
+        return self.represent(instance)
+
+
+class TagSerializer(FastRepresentationMixin, ModelSerializer):
     class Meta:
         model = Tag
         fields = (
@@ -23,14 +61,25 @@ class TagSerializer(ModelSerializer):
             'slug',
         )
 
+    def represent(self, tag):
+        return {
+            'id': tag.id,
+            'name': tag.name,
+            'color': tag.color,
+            'slug': tag.slug,
+        }
+
 
 class RecipeSummarySerializer(ModelSerializer):
+    thumbnails = RecipeThumbnailsField()
+
     class Meta:
         model = Recipe
         fields = (
             'id',
             'name',
             'image',
+            'thumbnails',
             'cooking_time',
         )
 
@@ -51,7 +100,7 @@ class IngredientForRecipeSerializer(ModelSerializer):
         )
 
 
-class UserDataSerializer(UserSerializer):
+class UserDataSerializer(FastRepresentationMixin, UserSerializer):
     is_subscribed = SerializerMethodField()
 
     class Meta:
@@ -63,6 +112,8 @@ class UserDataSerializer(UserSerializer):
             'first_name',
             'last_name',
             'is_subscribed',
+            'recipes_count',
+            'followers_count',
         )
 
     def get_is_subscribed(self, obj):
@@ -71,9 +122,19 @@ class UserDataSerializer(UserSerializer):
         if request.user.is_anonymous:
             return False
 
-        return Subscription.objects.filter(
-            user=request.user, author=obj.id
-        ).exists()
+        return obj.id in get_followed_author_ids(request)
+
+    def represent(self, user):
+        return {
+            'id': user.id,
+            'email': user.email,
+            'username': user.username,
+            'first_name': user.first_name,
+            'last_name': user.last_name,
+            'is_subscribed': self.get_is_subscribed(user),
+            'recipes_count': user.recipes_count,
+            'followers_count': user.followers_count,
+        }
 
 
 class NewAccountSerializer(UserCreateSerializer):
@@ -104,7 +165,7 @@ class NewAccountSerializer(UserCreateSerializer):
         return value
 
 
-class RecipeDetailSerializer(ModelSerializer):
+class RecipeDetailSerializer(FastRepresentationMixin, ModelSerializer):
     author = UserDataSerializer(read_only=True)
     ingredients = IngredientForRecipeSerializer(
         many=True,
@@ -112,7 +173,8 @@ class RecipeDetailSerializer(ModelSerializer):
         source='ingredient_in_recipe',
     )
     tags = TagSerializer(many=True, read_only=True)
-    image = Base64ImageField()
+    image = StreamingBase64ImageField()
+    thumbnails = RecipeThumbnailsField()
     is_favorited = SerializerMethodField()
     is_in_shopping_cart = SerializerMethodField()
 
@@ -126,36 +188,64 @@ class RecipeDetailSerializer(ModelSerializer):
             'ingredients',
             'tags',
             'image',
+            'thumbnails',
             'cooking_time',
             'is_favorited',
             'is_in_shopping_cart',
+            'favorites_count',
+            'in_carts_count',
         )
 
     def get_is_favorited(self, obj):
-        user = self.context.get('request').user
-
-        if user.is_anonymous:
-            return False
-
-        return obj.favorite.filter(user=user).exists()
+        request = self.context.get('request')
+        return obj.id in get_recipe_sets(request).favorites
 
     def get_is_in_shopping_cart(self, obj):
-        user = self.context.get('request').user
-
-        if user.is_anonymous:
-            return False
+        request = self.context.get('request')
+        return obj.id in get_recipe_sets(request).cart
 
-        return obj.cart.filter(user=user).exists()
+    def represent(self, recipe):
+        request = self.context.get('request')
+        recipe_sets = get_recipe_sets(request)
+
+        return {
+            'id': recipe.id,
+            'name': recipe.name,
+            'author': self.fields['author'].to_representation(recipe.author),
+            'text': recipe.text,
+            'ingredients': [
+                {
+                    'id': item.ingredient.id,
+                    'name': item.ingredient.name,
+                    'measurement_unit': item.ingredient.measurement_unit,
+                    'amount': item.amount,
+                }
+                for item in recipe.ingredient_in_recipe.all()
+            ],
+            'tags': [
+                {
+                    'id': tag.id,
+                    'name': tag.name,
+                    'color': tag.color,
+                    'slug': tag.slug,
+                }
+                for tag in recipe.tags.all()
+            ],
+            'image': file_url(recipe.image, request),
+            'thumbnails': thumbnail_urls(recipe, request),
+            'cooking_time': recipe.cooking_time,
+            'is_favorited': recipe.id in recipe_sets.favorites,
+            'is_in_shopping_cart': recipe.id in recipe_sets.cart,
+            'favorites_count': recipe.favorites_count,
+            'in_carts_count': recipe.in_carts_count,
+        }
 
 
 class RecipeWriteSerializer(ModelSerializer):
     author = UserDataSerializer(read_only=True)
     ingredients = IngredientForRecipeSerializer(many=True)
-    tags = PrimaryKeyRelatedField(
-        queryset=Tag.objects.all(),
-        many=True,
-    )
-    image = Base64ImageField()
+    tags = ListField(child=IntegerField())
+    image = StreamingBase64ImageField()
 
     class Meta:
         model = Recipe
@@ -175,6 +265,14 @@ class RecipeWriteSerializer(ModelSerializer):
             context={'request': self.context.get('request')},
         ).data
 
+    def save(self, **kwargs):
+        try:
+            return super().save(**kwargs)
+        finally:
+            image = self.validated_data.get('image')
+            if image is not None:
+                image.close()
+
     @staticmethod
     def validate(data):
         ingredients = data.get('ingredients')
@@ -203,36 +301,149 @@ class RecipeWriteSerializer(ModelSerializer):
                 'Tags must be unique.'
             )
 
+        # Both lookups run, so unknown tags and ingredients are reported
+        # together.
+        tags, errors = RecipeWriteSerializer.resolve_tags(tags)
+        errors.update(RecipeWriteSerializer.resolve_ingredients(ingredients))
+        if errors:
+            raise ValidationError(errors)
+
+        data['tags'] = tags
         return data
 
+    @staticmethod
+    def resolve_tags(tag_ids):
+        """Fetch every tag of the payload with a single query.
+
+        Returns the tags and a dict of errors about unknown IDs.
+        """
+        tags = Tag.objects.in_bulk(tag_ids)
+        missing = [pk for pk in tag_ids if pk not in tags]
+
+        if missing:
+            return [], {
+                'tags': [
+                    f'Invalid pk "{pk}" - object does not exist.'
+                    for pk in missing
+                ]
+            }
+
+        return [tags[pk] for pk in tag_ids], {}
+
+    @staticmethod
+    def resolve_ingredients(ingredients):
+        """Replace ingredient IDs in the payload with fetched objects.
+
+        All IDs are resolved with a single query, and unknown ones are
+        returned as errors against the list item they came from, in
+        which case the payload is left as it is.
+        """
+        found = Ingredient.objects.in_bulk(
+            [ingredient['ingredient']['id'] for ingredient in ingredients]
+        )
+        errors = [
+            {} if ingredient['ingredient']['id'] in found else {
+                'id': [
+                    f'Invalid pk "{ingredient["ingredient"]["id"]}" - '
+                    'object does not exist.'
+                ]
+            }
+            for ingredient in ingredients
+        ]
+
+        if any(errors):
+            return {'ingredients': errors}
+
+        for ingredient in ingredients:
+            ingredient['ingredient'] = found[ingredient['ingredient']['id']]
+        return {}
+
+    @staticmethod
+    def save_ingredients(recipe, ingredients, existing=None):
+        """Bring the recipe's ingredient rows in line with the payload.
+
+        Only rows that were added, removed or had their amount changed are
+        written, each kind with a single statement. The resulting change in
+        amounts is forwarded to the shopping list totals of every user who
+        has the recipe in their cart.
+        """
+        existing = existing or {}
+        deltas = {}
+        amounts = {
+            ingredient['ingredient'].id: ingredient['amount']
+            for ingredient in ingredients
+        }
+        resolved = {
+            ingredient['ingredient'].id: ingredient['ingredient']
+            for ingredient in ingredients
+        }
+
+        removed = existing.keys() - amounts.keys()
+        for ingredient_id in removed:
+            deltas[ingredient_id] = -existing[ingredient_id].amount
+        if removed:
+            IngredientInRecipe.objects.filter(
+                recipe=recipe, ingredient_id__in=removed
+            ).delete()
+
+        changed = []
+        for ingredient_id, row in existing.items():
+            amount = amounts.get(ingredient_id)
+            if amount is not None and row.amount != amount:
+                deltas[ingredient_id] = amount - row.amount
+                row.amount = amount
+                changed.append(row)
+        if changed:
+            IngredientInRecipe.objects.bulk_update(changed, ['amount'])
+
+        IngredientInRecipe.objects.bulk_create([
+            IngredientInRecipe(
+                recipe=recipe,
+                ingredient=resolved[ingredient_id],
+                amount=amount,
+            )
+            for ingredient_id, amount in amounts.items()
+            if ingredient_id not in existing
+        ])
+
+        if existing:
+            deltas.update(
+                (ingredient_id, amount)
+                for ingredient_id, amount in amounts.items()
+                if ingredient_id not in existing
+            )
+            ShoppingCartIngredient.change_recipe(recipe, deltas)
+
+    @transaction.atomic
     def create(self, validated_data):
         ingredients = validated_data.pop('ingredients')
         tags = validated_data.pop('tags')
         recipe = Recipe.objects.create(**validated_data)
         recipe.tags.set(tags)
-
-        for ingredient in ingredients:
-            IngredientInRecipe.objects.create(
-                recipe=recipe,
-                ingredient_id=ingredient.get('ingredient').get('id'),
-                amount=ingredient.get('amount'),
-            )
+        self.save_ingredients(recipe, ingredients)
+        schedule_thumbnails(recipe)
 
         return recipe
 
+    @transaction.atomic
     def update(self, instance, validated_data):
         tags = validated_data.pop('tags')
         ingredients = validated_data.pop('ingredients')
-        instance.tags.clear()
-        IngredientInRecipe.objects.filter(recipe=instance).delete()
         instance.tags.set(tags)
+        self.save_ingredients(
+            instance,
+            ingredients,
+            existing={
+                row.ingredient_id: row
+                for row in instance.ingredient_in_recipe.all()
+            },
+        )
 
-        for ingredient in ingredients:
-            IngredientInRecipe.objects.create(
-                recipe=instance,
-                ingredient_id=ingredient.get('ingredient').get('id'),
-                amount=ingredient.get('amount'),
-            )
+        if 'image' in validated_data:
+            discard_thumbnails(instance)
+            validated_data['thumbnail_webp'] = ''
+            validated_data['thumbnail_jpeg'] = ''
+            schedule_thumbnails(instance)
 
         return super().update(instance, validated_data)
 
@@ -249,11 +460,30 @@ class FavoriteRecipeSerializer(ModelSerializer):
         fields = '__all__'
 
 
-class IngredientSerializer(ModelSerializer):
+class RecipeBatchSerializer(Serializer):
+    recipes = ListField(
+        child=IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=100,
+    )
+
+    @staticmethod
+    def validate_recipes(value):
+        return list(dict.fromkeys(value))
+
+
+class IngredientSerializer(FastRepresentationMixin, ModelSerializer):
     class Meta:
         model = Ingredient
         fields = ('id', 'name', 'measurement_unit')
 
+    def represent(self, ingredient):
+        return {
+            'id': ingredient.id,
+            'name': ingredient.name,
+            'measurement_unit': ingredient.measurement_unit,
+        }
+
 
 class SubscriptionInfoSerializer(ModelSerializer):
     id = ReadOnlyField(source='author.id')
@@ -261,9 +491,10 @@ class SubscriptionInfoSerializer(ModelSerializer):
     username = ReadOnlyField(source='author.username')
     first_name = ReadOnlyField(source='author.first_name')
     last_name = ReadOnlyField(source='author.last_name')
+    followers_count = ReadOnlyField(source='author.followers_count')
     is_subscribed = SerializerMethodField()
     recipes = SerializerMethodField()
-    recipes_count = SerializerMethodField()
+    recipes_count = ReadOnlyField(source='author.recipes_count')
 
     class Meta:
         model = Subscription
@@ -276,6 +507,7 @@ class SubscriptionInfoSerializer(ModelSerializer):
             'is_subscribed',
             'recipes',
             'recipes_count',
+            'followers_count',
         )
 
     def get_is_subscribed(self, obj):
@@ -284,14 +516,15 @@ class SubscriptionInfoSerializer(ModelSerializer):
         if request.user.is_anonymous:
             return False
 
-        return Subscription.objects.filter(
-            user=request.user, author=obj.author.id
-        ).exists()
-
-    def get_recipes_count(self, obj):
-        return Recipe.objects.filter(author=obj.author.id).count()
+        return obj.author_id in get_followed_author_ids(request)
 
     def get_recipes(self, obj):
+        if hasattr(obj.author, 'subscription_recipes'):
+            return RecipeSummarySerializer(
+                obj.author.subscription_recipes,
+                many=True
+            ).data
+
         request = self.context.get('request')
         recipe_count = request.GET.get('recipes_limit')
         queryset = Recipe.objects.filter(author=obj.author.id)
@@ -0,0 +1,945 @@
+import base64
+import io
+import os
+import sqlite3
+import tempfile
+import threading
+import unittest
+from collections import Counter
+
+from django.contrib import admin
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.core.exceptions import ValidationError
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.db import connection, connections, transaction
+from django.db.models.signals import pre_delete
+from django.test import (SimpleTestCase, TestCase, TransactionTestCase,
+                         override_settings)
+from PIL import Image
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from recipes.models import (Favorite, Ingredient, IngredientInRecipe, Recipe,
+                            ShoppingCart, ShoppingCartIngredient, Tag)
+from users.admin import UserAdmin
+from users.models import Subscription
+
+from .authentication import token_users
+from .autocomplete import ingredient_index
+from .cache import UserRecipeSetsCache, user_recipe_sets
+from .fields import StreamingBase64ImageField
+
+User = get_user_model()
+
+
+def make_user(number):
+    return User.objects.create_user(
+        username=f'user{number}',
+        email=f'user{number}@example.com',
+        password='password',
+        first_name='First',
+        last_name='Last',
+    )
+
+
+def clear_caches():
+    for cache in caches.all():
+        cache.clear()
+    user_recipe_sets.entries.clear()
+    token_users.entries.clear()
+
+
+@override_settings(
+    PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher']
+)
+class QueryCountTestCase(TestCase):
+    """Endpoints whose query count must not grow with the page size."""
+    page_sizes = (1, 10, 30)
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.reader = make_user(0)
+        cls.authors = [make_user(number) for number in range(1, 31)]
+        tags = [
+            Tag.objects.create(name=name, color=color, slug=name)
+            for name, color in (('breakfast', 'blue'), ('dinner', 'green'))
+        ]
+        ingredients = [
+            Ingredient.objects.create(name=f'ingredient {number}',
+                                      measurement_unit='g')
+            for number in range(3)
+        ]
+        for author in cls.authors:
+            recipe = Recipe.objects.create(
+                author=author,
+                name=f'Recipe of {author.username}',
+                text='Text',
+                cooking_time=10,
+                image='recipe/image.png',
+            )
+            recipe.tags.set(tags)
+            IngredientInRecipe.objects.bulk_create([
+                IngredientInRecipe(recipe=recipe, ingredient=ingredient,
+                                   amount=5)
+                for ingredient in ingredients
+            ])
+            Favorite.objects.create(user=cls.reader, recipe=recipe)
+            ShoppingCart.objects.create(user=cls.reader, recipe=recipe)
+            Subscription.objects.create(user=cls.reader, author=author)
+
+    def setUp(self):
+        clear_caches()
+        self.anonymous = APIClient()
+        self.client = APIClient()
+        self.client.force_authenticate(self.reader)
+
+    def assert_queries_per_page(self, client, path, queries):
+        for limit in self.page_sizes:
+            with self.subTest(path=path, limit=limit):
+                clear_caches()
+                with self.assertNumQueries(queries):
+                    response = client.get(path, {'limit': limit})
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(len(response.data['results']), limit)
+
+    def test_recipe_list_anonymous(self):
+        # COUNT, recipes with authors, tags, ingredients.
+        self.assert_queries_per_page(self.anonymous, '/api/recipes/', 4)
+
+    def test_recipe_list_authenticated(self):
+        # Plus the user's favorite and cart IDs and followed authors.
+        self.assert_queries_per_page(self.client, '/api/recipes/', 6)
+
+    def test_user_list_anonymous(self):
+        # COUNT, users.
+        self.assert_queries_per_page(self.anonymous, '/api/users/', 2)
+
+    def test_user_list_authenticated(self):
+        # Plus the followed authors, looked up once for the whole page.
+        self.assert_queries_per_page(self.client, '/api/users/', 3)
+
+    def test_subscriptions(self):
+        # COUNT, followed authors, their latest recipes, and the followed
+        # author IDs behind is_subscribed.
+        for author in self.authors:
+            Recipe.objects.create(
+                author=author,
+                name='Second recipe',
+                text='Text',
+                cooking_time=10,
+                image='recipe/image.png',
+            )
+
+        path = '/api/users/subscriptions/'
+        for recipes_limit in (None, 1, 2):
+            for limit in (1, len(self.authors)):
+                with self.subTest(limit=limit, recipes_limit=recipes_limit):
+                    clear_caches()
+                    params = {'limit': limit}
+                    if recipes_limit is not None:
+                        params['recipes_limit'] = recipes_limit
+                    with self.assertNumQueries(4):
+                        response = self.client.get(path, params)
+                    self.assertEqual(response.status_code, 200)
+                    results = response.data['results']
+                    self.assertEqual(len(results), limit)
+                    self.assertEqual(
+                        {len(author['recipes']) for author in results},
+                        {recipes_limit or 2},
+                    )
+
+    def test_user_list_hundred(self):
+        for number in range(31, 101):
+            make_user(number)
+
+        with self.assertNumQueries(3):
+            response = self.client.get('/api/users/', {'limit': 100})
+        self.assertEqual(len(response.data['results']), 100)
+        followed = [
+            user['is_subscribed'] for user in response.data['results']
+        ]
+        self.assertEqual(followed.count(True), len(self.authors))
+
+
+@override_settings(
+    PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher']
+)
+class ConcurrentToggleTestCase(TransactionTestCase):
+    """Parallel identical toggles must change each link exactly once."""
+    threads = 8
+
+    def setUp(self):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest(
+                'Threads need a file or server database, set DB_TEST_NAME.'
+            )
+
+        clear_caches()
+        self.user = make_user(0)
+        self.author = make_user(1)
+        self.recipe = Recipe.objects.create(
+            author=self.author,
+            name='Recipe',
+            text='Text',
+            cooking_time=10,
+            image='recipe/image.png',
+        )
+        IngredientInRecipe.objects.create(
+            recipe=self.recipe,
+            ingredient=Ingredient.objects.create(
+                name='salt', measurement_unit='g'
+            ),
+            amount=5,
+        )
+
+    def fire(self, method, path, succeeded, rejected):
+        """Send the same request from every thread at once."""
+        statuses = []
+        barrier = threading.Barrier(self.threads)
+
+        def request():
+            client = APIClient()
+            client.force_authenticate(self.user)
+            try:
+                barrier.wait()
+                statuses.append(getattr(client, method)(path).status_code)
+            finally:
+                connections.close_all()
+
+        workers = [
+            threading.Thread(target=request) for _ in range(self.threads)
+        ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        self.assertEqual(
+            Counter(statuses), {succeeded: 1, rejected: self.threads - 1}
+        )
+
+    def test_favorite(self):
+        path = f'/api/recipes/{self.recipe.pk}/favorite/'
+
+        self.fire('post', path, 201, 400)
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.favorites_count, 1)
+        self.assertEqual(Favorite.objects.count(), 1)
+
+        self.fire('delete', path, 204, 400)
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.favorites_count, 0)
+        self.assertFalse(Favorite.objects.exists())
+
+    def test_shopping_cart(self):
+        path = f'/api/recipes/{self.recipe.pk}/shopping_cart/'
+
+        self.fire('post', path, 201, 400)
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.in_carts_count, 1)
+        self.assertEqual(
+            list(ShoppingCartIngredient.objects.values_list(
+                'amount', flat=True
+            )),
+            [5],
+        )
+
+        self.fire('delete', path, 204, 400)
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.in_carts_count, 0)
+        self.assertFalse(ShoppingCartIngredient.objects.exists())
+
+    def test_subscribe(self):
+        path = f'/api/users/{self.author.pk}/subscribe/'
+
+        self.fire('post', path, 201, 400)
+        self.author.refresh_from_db()
+        self.assertEqual(self.author.followers_count, 1)
+        self.assertEqual(Subscription.objects.count(), 1)
+
+        self.fire('delete', path, 204, 404)
+        self.author.refresh_from_db()
+        self.assertEqual(self.author.followers_count, 0)
+        self.assertFalse(Subscription.objects.exists())
+
+
+class ResponseCacheInvalidationTestCase(TestCase):
+    """Writes drop the cached responses that depend on them, and no more."""
+
+    def setUp(self):
+        clear_caches()
+        self.user = make_user(0)
+        self.recipes = [
+            Recipe.objects.create(
+                author=make_user(number),
+                name=f'Recipe {number}',
+                text='Text',
+                cooking_time=10,
+                image='recipe/image.png',
+            )
+            for number in (1, 2)
+        ]
+        ingredient = Ingredient.objects.create(name='salt',
+                                               measurement_unit='g')
+        self.row = IngredientInRecipe.objects.create(
+            recipe=self.recipes[0], ingredient=ingredient, amount=5
+        )
+        self.anonymous = APIClient()
+        self.paths = [
+            f'/api/recipes/{recipe.pk}/' for recipe in self.recipes
+        ]
+        for path in self.paths:
+            self.assertEqual(self.cache_status(path), 'MISS')
+
+    def cache_status(self, path):
+        response = self.anonymous.get(path)
+        self.assertEqual(response.status_code, 200)
+        return response['X-Cache']
+
+    def assert_cached(self, *statuses):
+        self.assertEqual(
+            [self.cache_status(path) for path in self.paths], list(statuses)
+        )
+
+    def test_favorite(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Favorite.objects.create(user=self.user, recipe=self.recipes[0])
+        self.assert_cached('MISS', 'HIT')
+
+    def test_recipe_ingredient_edit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.row.amount = 10
+            self.row.save()
+        self.assert_cached('MISS', 'HIT')
+
+    def test_unrelated_write(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Subscription.objects.create(
+                user=self.user, author=self.recipes[1].author
+            )
+        self.assert_cached('HIT', 'MISS')
+
+    def test_bulk_commands(self):
+        for command in ('recount_counters', 'rebuild_tags_masks',
+                        'rebuild_trending_scores'):
+            with self.subTest(command=command):
+                self.assert_cached('HIT', 'HIT')
+                with self.captureOnCommitCallbacks(execute=True):
+                    call_command(command, stdout=io.StringIO())
+                self.assert_cached('MISS', 'MISS')
+
+
+class LoadIngredientsTestCase(TestCase):
+    rows = (
+        'zucchini,g\n'
+        'zucchini,g\n'
+        'zucchini flowers,piece\n'
+        'broken row\n'
+    )
+
+    def setUp(self):
+        clear_caches()
+        Ingredient.objects.create(name='zucchini', measurement_unit='g')
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = directory.name
+        with open(os.path.join(self.path, 'ingredients.csv'), 'w') as file:
+            file.write(self.rows)
+
+    def load(self):
+        # The index is built before the load, so it has to be refreshed.
+        self.assertEqual(len(ingredient_index.search('zucchini', 10)), 1)
+        output = io.StringIO()
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('load_ingredients', '--path', self.path,
+                         stdout=output)
+
+        self.assertIn(
+            '1 inserted, 2 skipped as duplicates, 1 malformed',
+            output.getvalue(),
+        )
+        self.assertEqual(
+            sorted(Ingredient.objects.values_list('name', flat=True)),
+            ['zucchini', 'zucchini flowers'],
+        )
+        self.assertEqual(len(ingredient_index.search('zucchini', 10)), 2)
+
+    @unittest.skipIf(connection.vendor == 'postgresql',
+                     'PostgreSQL loads through COPY.')
+    def test_bulk_create(self):
+        self.load()
+
+    @unittest.skipUnless(connection.vendor == 'postgresql',
+                         'COPY staging is only used on PostgreSQL.')
+    def test_copy(self):
+        self.load()
+
+
+class RecipeWriteValidationTestCase(TestCase):
+    def test_unknown_tags_and_ingredients_are_reported_together(self):
+        tag = Tag.objects.create(name='dinner', color='#00ff00',
+                                 slug='dinner')
+        ingredient = Ingredient.objects.create(name='salt',
+                                               measurement_unit='g')
+        client = APIClient()
+        client.force_authenticate(make_user(0))
+
+        response = client.post('/api/recipes/', {
+            'name': 'Soup',
+            'text': 'Boil everything.',
+            'cooking_time': 10,
+            'image': (
+                'data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAAAEAAAABAQMAAA'
+                'Al21bKAAAAA1BMVEUAAACnej3aAAAAAXRSTlMAQObYZgAAAApJREFUCNdjYAA'
+                'AAAIAAeIhvDMAAAAASUVORK5CYII='
+            ),
+            'tags': [tag.pk, 999],
+            'ingredients': [
+                {'id': ingredient.pk, 'amount': 10},
+                {'id': 998, 'amount': 5},
+            ],
+        }, format='json')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data, {
+            'tags': ['Invalid pk "999" - object does not exist.'],
+            'ingredients': [
+                {},
+                {'id': ['Invalid pk "998" - object does not exist.']},
+            ],
+        })
+        self.assertFalse(Recipe.objects.exists())
+
+
+class TagBitTestCase(TestCase):
+    def make_tags(self, count, **fields):
+        return Tag.objects.bulk_create([
+            Tag(name=f'tag {number}', color=f'#{number:06x}',
+                slug=f'tag-{number}', **{
+                    name: value(number) for name, value in fields.items()
+                })
+            for number in range(count)
+        ])
+
+    def test_no_free_bit_is_a_validation_error(self):
+        self.make_tags(Tag.MAX_TAGS, bit=lambda number: number)
+        tag = Tag(name='extra', color='#ffffff', slug='extra')
+
+        with self.assertRaises(ValidationError):
+            tag.full_clean()
+
+    def test_tag_without_bit_matches_nothing(self):
+        author = make_user(0)
+        recipe = Recipe.objects.create(
+            author=author,
+            name='Recipe',
+            text='Text',
+            cooking_time=10,
+            image='recipe/image.png',
+        )
+        tagged = Tag.objects.create(name='tagged', color='#abcdef',
+                                    slug='tagged')
+        recipe.tags.add(tagged)
+        self.make_tags(1)
+        client = APIClient()
+
+        for tags, tags_match, count in (
+            (['tagged'], 'all', 1),
+            (['tag-0'], 'any', 0),
+            (['tag-0'], 'all', 0),
+            (['tagged', 'tag-0'], 'any', 1),
+            (['tagged', 'tag-0'], 'all', 0),
+        ):
+            with self.subTest(tags=tags, tags_match=tags_match):
+                clear_caches()
+                response = client.get('/api/recipes/', {
+                    'tags': tags, 'tags_match': tags_match, 'limit': 10,
+                })
+                self.assertEqual(response.data['count'], count)
+
+
+class FailedRecipeDeleteTestCase(TestCase):
+    def fail(self, **kwargs):
+        raise RuntimeError('Delete failed.')
+
+    def test_counters_still_count_after_rollback(self):
+        user = make_user(0)
+        recipe = Recipe.objects.create(
+            author=user,
+            name='Recipe',
+            text='Text',
+            cooking_time=10,
+            image='recipe/image.png',
+        )
+        favorite = Favorite.objects.create(user=user, recipe=recipe)
+
+        pre_delete.connect(self.fail, sender=Recipe)
+        try:
+            with self.assertRaises(RuntimeError), transaction.atomic():
+                recipe.delete()
+        finally:
+            pre_delete.disconnect(self.fail, sender=Recipe)
+
+        favorite.delete()
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.favorites_count, 0)
+
+
+class CartTestCase(TestCase):
+    """Two users and three recipes sharing some of their ingredients."""
+
+    def setUp(self):
+        clear_caches()
+        self.users = [make_user(number) for number in range(2)]
+        ingredients = [
+            Ingredient.objects.create(name=f'ingredient {number}',
+                                      measurement_unit='g')
+            for number in range(3)
+        ]
+        self.recipes = []
+        for number in range(3):
+            recipe = Recipe.objects.create(
+                author=self.users[0],
+                name=f'Recipe {number}',
+                text='Text',
+                cooking_time=10,
+                image='recipe/image.png',
+            )
+            IngredientInRecipe.objects.bulk_create([
+                IngredientInRecipe(recipe=recipe, ingredient=ingredient,
+                                   amount=number + 1)
+                for ingredient in ingredients[number:]
+            ])
+            self.recipes.append(recipe)
+
+    def assert_totals_are_live(self):
+        self.assertEqual(
+            set(ShoppingCartIngredient.objects.values_list(
+                'user_id', 'ingredient_id', 'amount'
+            )),
+            set(ShoppingCartIngredient.live_totals()),
+        )
+
+
+class CartTotalsTestCase(CartTestCase):
+    """Shopping list totals follow every cart write, not just the API."""
+
+    def test_orm_writes(self):
+        carts = [
+            ShoppingCart.objects.create(user=user, recipe=recipe)
+            for user in self.users for recipe in self.recipes
+        ]
+        self.assertTrue(ShoppingCartIngredient.objects.exists())
+        self.assert_totals_are_live()
+
+        carts[0].delete()
+        self.assert_totals_are_live()
+
+        ShoppingCart.objects.filter(recipe=self.recipes[1]).delete()
+        self.assert_totals_are_live()
+
+        self.recipes[2].delete()
+        self.assert_totals_are_live()
+
+    def test_api_toggle(self):
+        client = APIClient()
+        client.force_authenticate(self.users[1])
+        path = f'/api/recipes/{self.recipes[0].pk}/shopping_cart/'
+
+        self.assertEqual(client.post(path).status_code, 201)
+        self.assertTrue(ShoppingCartIngredient.objects.exists())
+        self.assert_totals_are_live()
+
+        self.assertEqual(client.delete(path).status_code, 204)
+        self.assertFalse(ShoppingCartIngredient.objects.exists())
+
+
+class BatchLinksTestCase(CartTestCase):
+    """The batch endpoints report a status for every requested recipe."""
+
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.client.force_authenticate(self.users[1])
+        self.unknown = max(recipe.pk for recipe in self.recipes) + 1
+
+    def change(self, method, endpoint, ids):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = getattr(self.client, method)(
+                f'/api/recipes/{endpoint}/', {'recipes': ids}, format='json'
+            )
+        self.assertEqual(response.status_code, 200)
+        return {
+            result['id']: result['status']
+            for result in response.data['results']
+        }
+
+    def assert_counted(self, counter, model):
+        for recipe in Recipe.objects.all():
+            self.assertEqual(
+                getattr(recipe, counter),
+                model.objects.filter(recipe=recipe).count(),
+            )
+
+    def check_links(self, endpoint, model, counter):
+        first, second, third = (recipe.pk for recipe in self.recipes)
+        model.objects.create(user=self.users[1], recipe=self.recipes[0])
+
+        self.assertEqual(
+            self.change('post', endpoint, [first, second, self.unknown]),
+            {first: 'already_exists', second: 'created',
+             self.unknown: 'not_found'},
+        )
+        self.assertEqual(
+            set(model.objects.filter(user=self.users[1]).values_list(
+                'recipe_id', flat=True
+            )),
+            {first, second},
+        )
+        self.assert_counted(counter, model)
+        self.assert_totals_are_live()
+
+        self.assertEqual(
+            self.change('delete', endpoint, [second, third, self.unknown]),
+            {second: 'deleted', third: 'not_found',
+             self.unknown: 'not_found'},
+        )
+        self.assertEqual(
+            list(model.objects.filter(user=self.users[1]).values_list(
+                'recipe_id', flat=True
+            )),
+            [first],
+        )
+        self.assert_counted(counter, model)
+        self.assert_totals_are_live()
+
+    def test_favorites(self):
+        self.check_links('favorite', Favorite, 'favorites_count')
+
+    def test_shopping_cart(self):
+        self.check_links('shopping_cart', ShoppingCart, 'in_carts_count')
+
+    def test_recipe_flags_follow_batch(self):
+        ids = [recipe.pk for recipe in self.recipes]
+        path = f'/api/recipes/{ids[0]}/'
+        self.assertFalse(self.client.get(path).data['is_favorited'])
+
+        self.change('post', 'favorite', ids)
+        self.assertTrue(self.client.get(path).data['is_favorited'])
+
+        self.change('delete', 'favorite', ids)
+        self.assertFalse(self.client.get(path).data['is_favorited'])
+
+    def test_invalid_batch(self):
+        for ids in ([], [0], ['recipe'], list(range(1, 102))):
+            response = self.client.post(
+                '/api/recipes/favorite/', {'recipes': ids}, format='json'
+            )
+            self.assertEqual(response.status_code, 400, ids)
+        self.assertFalse(Favorite.objects.exists())
+
+    def test_anonymous(self):
+        response = APIClient().post(
+            '/api/recipes/favorite/', {'recipes': [self.recipes[0].pk]},
+            format='json',
+        )
+        self.assertEqual(response.status_code, 401)
+
+
+class UserRecipeSetsCacheTestCase(TestCase):
+    """Two instances stand for two worker processes sharing one cache."""
+
+    def setUp(self):
+        clear_caches()
+        self.user = make_user(0)
+        self.recipes = [
+            Recipe.objects.create(
+                author=self.user,
+                name=f'Recipe {number}',
+                text='Text',
+                cooking_time=10,
+                image='recipe/image.png',
+            )
+            for number in range(2)
+        ]
+
+    def favorite(self, worker, recipe):
+        Favorite.objects.create(user=self.user, recipe=recipe)
+        worker.update(self.user.pk, 'favorites', {recipe.pk})
+
+    def test_write_on_stale_copy_reloads(self):
+        first, second = UserRecipeSetsCache(), UserRecipeSetsCache()
+        self.assertEqual(first.get(self.user.pk).favorites, set())
+
+        self.favorite(second, self.recipes[0])
+        self.favorite(first, self.recipes[1])
+
+        expected = {recipe.pk for recipe in self.recipes}
+        self.assertEqual(first.get(self.user.pk).favorites, expected)
+        self.assertEqual(second.get(self.user.pk).favorites, expected)
+
+    def test_write_on_current_copy_is_patched(self):
+        worker = UserRecipeSetsCache()
+        worker.get(self.user.pk)
+        self.favorite(worker, self.recipes[0])
+
+        with self.assertNumQueries(0):
+            favorites = worker.get(self.user.pk).favorites
+        self.assertEqual(favorites, {self.recipes[0].pk})
+
+    def test_old_copy_reloads(self):
+        worker = UserRecipeSetsCache(max_age=-1)
+        worker.get(self.user.pk)
+        Favorite.objects.create(user=self.user, recipe=self.recipes[0])
+
+        self.assertEqual(
+            worker.get(self.user.pk).favorites, {self.recipes[0].pk}
+        )
+
+
+@override_settings(
+    PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'],
+    REPLICA_DATABASES=['replica'],
+)
+class ReplicaRoutingTestCase(TransactionTestCase):
+    """Reads go to a lagging replica, except right after a client writes.
+
+    The replica is a second SQLite file copied from the test database
+    before the newest recipe is published, so any read that reaches it
+    misses that recipe.
+    """
+    @classmethod
+    def setUpClass(cls):
+        if connection.vendor != 'sqlite':
+            raise unittest.SkipTest('The replica is copied as an SQLite file.')
+
+        super().setUpClass()
+        # Registered after the test case has blocked unlisted databases,
+        # as the system checks cannot see it when the tests start.
+        cls.directory = tempfile.TemporaryDirectory()
+        cls.replica_name = os.path.join(cls.directory.name, 'replica.sqlite3')
+        connections.databases['replica'] = {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': cls.replica_name,
+        }
+
+    @classmethod
+    def tearDownClass(cls):
+        connections['replica'].close()
+        del connections['replica']
+        del connections.databases['replica']
+        cls.directory.cleanup()
+        super().tearDownClass()
+
+    def setUp(self):
+        clear_caches()
+        self.user = make_user(0)
+        self.author = make_user(1)
+        self.publish('Replicated recipe')
+
+        connection.ensure_connection()
+        connections['replica'].close()
+        replica = sqlite3.connect(self.replica_name)
+        connection.connection.backup(replica)
+        replica.close()
+
+        self.recipe = self.publish('New recipe')
+        self.anonymous = APIClient()
+        self.client = APIClient()
+        self.client.credentials(
+            HTTP_AUTHORIZATION=f'Token {Token.objects.create(user=self.user)}'
+        )
+
+    def publish(self, name):
+        return Recipe.objects.create(
+            author=self.author,
+            name=name,
+            text='Text',
+            cooking_time=10,
+            image='recipe/image.png',
+        )
+
+    def count_recipes(self, client):
+        caches['responses'].clear()
+        response = client.get('/api/recipes/', {'limit': 10})
+        self.assertEqual(response.status_code, 200)
+        return response.data['count']
+
+    def test_safe_requests_read_from_replica(self):
+        self.assertEqual(self.count_recipes(self.anonymous), 1)
+        self.assertEqual(self.count_recipes(self.client), 1)
+        # Code outside of requests always reads the primary.
+        self.assertEqual(Recipe.objects.count(), 2)
+
+    def test_writes_go_to_primary_and_stick(self):
+        response = self.client.post(
+            f'/api/recipes/{self.recipe.pk}/favorite/'
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue(Favorite.objects.using('default').exists())
+        self.assertFalse(Favorite.objects.using('replica').exists())
+
+        # The writer reads its own write, other clients the replica.
+        self.assertEqual(self.count_recipes(self.client), 2)
+        self.assertEqual(self.count_recipes(self.anonymous), 1)
+
+        caches['default'].clear()
+        self.assertEqual(self.count_recipes(self.client), 1)
+
+
+class RebuildThumbnailsTestCase(TransactionTestCase):
+    def setUp(self):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest(
+                'Thumbnails are made in a thread, set DB_TEST_NAME.'
+            )
+
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        media = override_settings(MEDIA_ROOT=directory.name)
+        media.enable()
+        self.addCleanup(media.disable)
+
+        image = io.BytesIO()
+        Image.new('RGB', (64, 64), 'red').save(image, 'PNG')
+        self.recipe = Recipe.objects.create(
+            author=make_user(0),
+            name='Recipe',
+            text='Text',
+            cooking_time=10,
+            image=default_storage.save(
+                'recipe/photo.png', ContentFile(image.getvalue())
+            ),
+        )
+
+    def thumbnails(self):
+        self.recipe.refresh_from_db()
+        return [self.recipe.thumbnail_webp.name,
+                self.recipe.thumbnail_jpeg.name]
+
+    def test_missing_and_replaced_thumbnails(self):
+        call_command('rebuild_thumbnails', stdout=io.StringIO())
+        first = self.thumbnails()
+        self.assertTrue(all(first))
+        self.assertTrue(all(default_storage.exists(name) for name in first))
+
+        call_command('rebuild_thumbnails', '--all', stdout=io.StringIO())
+        second = self.thumbnails()
+        self.assertTrue(all(default_storage.exists(name) for name in second))
+        self.assertFalse(any(default_storage.exists(name) for name in first))
+
+
+@override_settings(
+    PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher']
+)
+class TokenUserCacheTestCase(TestCase):
+    """Cached tokens stop working as soon as the user or token changes."""
+    path = '/api/users/me/'
+
+    def setUp(self):
+        clear_caches()
+        self.user = make_user(0)
+        response = self.client.post('/api/auth/token/login/', {
+            'email': self.user.email, 'password': 'password',
+        })
+        self.key = response.data['auth_token']
+        self.api = APIClient()
+        self.api.credentials(HTTP_AUTHORIZATION=f'Token {self.key}')
+        self.assertEqual(self.api.get(self.path).status_code, 200)
+        self.assertIsNotNone(token_users.get(self.key))
+
+    def test_cached_token_skips_the_token_query(self):
+        # Only the followed authors are read, the token is cached.
+        with self.assertNumQueries(1):
+            self.assertEqual(self.api.get(self.path).status_code, 200)
+
+    def test_logout(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.api.post('/api/auth/token/logout/')
+        self.assertEqual(response.status_code, 204)
+
+        self.assertEqual(self.api.get(self.path).status_code, 401)
+
+    def test_password_change(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.api.post('/api/users/set_password/', {
+                'current_password': 'password',
+                'new_password': 'another-password-42',
+            })
+        self.assertEqual(response.status_code, 204)
+
+        self.assertIsNone(token_users.get(self.key))
+
+    def test_deactivation(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.is_active = False
+            self.user.save()
+
+        self.assertEqual(self.api.get(self.path).status_code, 401)
+
+    def test_admin_deactivation(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            UserAdmin(User, admin.site).deactivate(
+                None, User.objects.filter(pk=self.user.pk)
+            )
+
+        self.assertEqual(self.api.get(self.path).status_code, 401)
+
+    def test_ttl_setting(self):
+        with override_settings(TOKEN_CACHE_TTL=-1):
+            self.assertIsNone(token_users.get(self.key))
+
+
+class MetricsAccessTestCase(TestCase):
+    path = '/api/metrics'
+
+    def test_denied_without_token(self):
+        self.assertEqual(self.client.get(self.path).status_code, 403)
+        self.assertEqual(
+            self.client.get(
+                self.path, HTTP_AUTHORIZATION='Bearer None'
+            ).status_code,
+            403,
+        )
+
+    def test_staff(self):
+        user = make_user(0)
+        self.client.force_login(user)
+        self.assertEqual(self.client.get(self.path).status_code, 403)
+
+        user.is_staff = True
+        user.save()
+        self.assertEqual(self.client.get(self.path).status_code, 200)
+
+    @override_settings(METRICS_TOKEN='secret')
+    def test_token(self):
+        for authorization, status in (
+            ('Bearer secret', 200),
+            ('Bearer wrong', 403),
+            ('Bearer sécret', 403),
+            ('', 403),
+        ):
+            with self.subTest(authorization=authorization):
+                response = self.client.get(
+                    self.path, HTTP_AUTHORIZATION=authorization
+                )
+                self.assertEqual(response.status_code, status)
+
+
+class StreamingBase64ImageFieldTestCase(SimpleTestCase):
+    def test_line_wrapped_payload(self):
+        image = io.BytesIO()
+        Image.new('RGB', (64, 64), 'red').save(image, 'PNG')
+        field = StreamingBase64ImageField()
+        field.chunk_size = 16
+
+        for encode in (base64.b64encode, base64.encodebytes):
+            with self.subTest(encode=encode.__name__):
+                file = field.to_internal_value(
+                    'data:image/png;base64,'
+                    + encode(image.getvalue()).decode()
+                )
+                self.assertEqual(file.read(), image.getvalue())
@@ -1,22 +1,34 @@
 from django.contrib.auth import get_user_model
-from django.db.models import Sum
-from django.http import HttpResponse
+from django.db import transaction
+from django.db.models import F, Prefetch
+from django.db.models.expressions import RawSQL
+from django.http import StreamingHttpResponse
 from django.shortcuts import get_object_or_404
 from djoser.views import UserViewSet
 from rest_framework import status
 from rest_framework.decorators import action
+from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
+from rest_framework.validators import ValidationError
 from rest_framework.viewsets import ModelViewSet, ReadOnlyModelViewSet
 
 from users.models import Subscription
-from recipes.models import (Favorite, Ingredient, IngredientInRecipe, Recipe,
-                            ShoppingCart, Tag)
-
-from .filters import CustomSearchFilter, RecipeFilterSet
-from .paginations import PageLimitPagination
+from recipes.models import (Favorite, FeedEntry, Ingredient,
+                            IngredientInRecipe, Recipe, ShoppingCart,
+                            ShoppingCartIngredient, Tag)
+
+from .cache import (CachedResponseMixin, recipe_cache_tags, response_cache,
+                    user_recipe_sets)
+from .filters import IngredientAutocompleteFilter, RecipeFilterSet
+from .links import create_link, delete_link, insert_links, remove_links
+from .paginations import (FeedCursorPagination, PageLimitPagination,
+                          RecipePagination)
 from .permissions import AuthorOrReadOnlyPermission
+from .renderers import (ShoppingListCSVRenderer, ShoppingListJSONRenderer,
+                        ShoppingListTextRenderer)
 from .serializers import (FavoriteRecipeSerializer, IngredientSerializer,
-                          NewAccountSerializer, RecipeDetailSerializer,
+                          NewAccountSerializer, RecipeBatchSerializer,
+                          RecipeDetailSerializer,
                           RecipeWriteSerializer, ShoppingCartRecipeSerializer,
                           SubscriptionInfoSerializer, TagSerializer,
                           UserDataSerializer)
@@ -24,16 +36,51 @@ from .serializers import (FavoriteRecipeSerializer, IngredientSerializer,
 User = get_user_model()
 
 
-class TagViewSet(ReadOnlyModelViewSet):
+def with_recipe_details(queryset):
+    """Load everything `RecipeDetailSerializer` reads in four queries."""
+    return queryset.defer('search_vector').select_related(
+        'author'
+    ).prefetch_related(
+        Prefetch('tags', queryset=Tag.objects.all()),
+        Prefetch(
+            'ingredient_in_recipe',
+            queryset=IngredientInRecipe.objects.select_related(
+                'ingredient'
+            ),
+        ),
+    )
+
+
+def latest_recipes_for_subscriptions(user, limit):
+    """Return the `limit` newest recipes of every author `user` follows.
+
+    Recipes are ranked per author with ROW_NUMBER() in a single query, so
+    the result can be used as a prefetch queryset for any number of authors.
+    """
+    ranked = (
+        'SELECT ranked.id FROM ('
+        'SELECT recipe.id, ROW_NUMBER() OVER ('
+        'PARTITION BY recipe.author_id '
+        'ORDER BY recipe.pub_date DESC, recipe.id DESC'
+        ') AS author_rank '
+        f'FROM {Recipe._meta.db_table} recipe '
+        'WHERE recipe.author_id IN ('
+        f'SELECT author_id FROM {Subscription._meta.db_table} '
+        'WHERE user_id = %s)'
+        ') ranked WHERE ranked.author_rank <= %s'
+    )
+    return Recipe.objects.filter(pk__in=RawSQL(ranked, (user.id, limit)))
+
+
+class TagViewSet(CachedResponseMixin, ReadOnlyModelViewSet):
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
 
 
-class IngredientViewSet(ReadOnlyModelViewSet):
+class IngredientViewSet(CachedResponseMixin, ReadOnlyModelViewSet):
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
-    filter_backends = (CustomSearchFilter,)
-    search_fields = ('name',)
+    filter_backends = (IngredientAutocompleteFilter,)
 
 
 class NewUserViewSet(UserViewSet):
@@ -49,37 +96,57 @@ class NewUserViewSet(UserViewSet):
     @action(detail=True, methods=['POST', 'DELETE'])
     def subscribe(self, request, id):
         user = request.user
-        author = get_object_or_404(User, id=id)
 
         if request.method == 'POST':
-            if user == author:
-                return Response(status=status.HTTP_400_BAD_REQUEST)
-
-            if Subscription.objects.filter(user=user, author=author).exists():
+            subscription = None
+            if id.isdigit():
+                subscription = create_link(
+                    Subscription, 'user', user.id, 'author', int(id),
+                    exclude_self=True,
+                )
+            if subscription is None:
+                # Nothing was inserted: the author is missing, is the user
+                # themselves or is already followed.
+                get_object_or_404(User, id=id)
                 return Response(status=status.HTTP_400_BAD_REQUEST)
 
-            subscription = Subscription.objects.create(
-                user=user,
-                author=author
-            )
+            subscription.author = User.objects.get(pk=subscription.author_id)
             serializer = SubscriptionInfoSerializer(
                 subscription,
                 context={'request': request}
             )
             return Response(serializer.data, status=status.HTTP_201_CREATED)
 
-        the_subscribe = get_object_or_404(
-            Subscription,
-            user=user,
-            author=author
-        )
-        the_subscribe.delete()
+        if not id.isdigit() or not delete_link(
+            Subscription, 'user', user.id, 'author', int(id)
+        ):
+            return Response(status=status.HTTP_404_NOT_FOUND)
         return Response(status=status.HTTP_204_NO_CONTENT)
 
     @action(detail=False)
     def subscriptions(self, request):
         user = request.user
-        queryset = Subscription.objects.filter(user=user)
+        recipes_limit = request.query_params.get('recipes_limit')
+
+        if recipes_limit and recipes_limit.isdigit():
+            recipes = latest_recipes_for_subscriptions(
+                user, int(recipes_limit)
+            )
+        else:
+            recipes = Recipe.objects.all()
+
+        queryset = (
+            Subscription.objects.filter(user=user)
+            .select_related('author')
+            .prefetch_related(
+                Prefetch(
+                    'author__recipes',
+                    queryset=recipes,
+                    to_attr='subscription_recipes',
+                )
+            )
+            .order_by('id')
+        )
         pages = self.paginate_queryset(queryset)
         serializer = SubscriptionInfoSerializer(
             pages,
@@ -91,12 +158,26 @@ class NewUserViewSet(UserViewSet):
         return self.get_paginated_response(serializer.data)
 
 
-class RecipeViewSet(ModelViewSet):
+class RecipeViewSet(CachedResponseMixin, ModelViewSet):
     queryset = Recipe.objects.all()
     serializer_class = RecipeWriteSerializer
     permission_classes = [AuthorOrReadOnlyPermission]
     filterset_class = RecipeFilterSet
-    pagination_class = PageLimitPagination
+    pagination_class = RecipePagination
+
+    def get_cache_tags(self, data):
+        tags = recipe_cache_tags(data)
+        if self.action == 'list':
+            tags.append('recipe-list')
+        return tags
+
+    def get_queryset(self):
+        queryset = Recipe.objects.all()
+
+        if self.action not in ['list', 'retrieve']:
+            return queryset
+
+        return with_recipe_details(queryset)
 
     def perform_create(self, serializer):
         serializer.save(author=self.request.user)
@@ -106,95 +187,189 @@ class RecipeViewSet(ModelViewSet):
             return RecipeDetailSerializer
         return RecipeWriteSerializer
 
+    def toggle_link(self, request, pk, model, serializer_class):
+        """Add or remove a favorite or cart entry with a single statement.
+
+        Returns the created link, or None for a successful removal.
+        """
+        user_id = request.user.id
+        valid_pk = str(pk).isdigit()
+
+        if request.method == 'POST':
+            link = None
+            if user_id is not None and valid_pk:
+                link = create_link(model, 'user', user_id, 'recipe', int(pk))
+            if link is None:
+                # Nothing was inserted, let the serializer explain why.
+                serializer = serializer_class(
+                    data={'user': user_id, 'recipe': pk},
+                    context={'request': request},
+                )
+                serializer.is_valid(raise_exception=True)
+                raise ValidationError('Recipe is already added.')
+            return link
+
+        if not valid_pk or not delete_link(
+            model, 'user', user_id, 'recipe', int(pk)
+        ):
+            raise ValidationError('Recipe is not added.')
+        return None
+
     @action(
         detail=True,
         methods=['POST', 'DELETE']
     )
     def favorite(self, request, pk):
-        if request.method == 'POST':
-            data = {'user': request.user.id, 'recipe': pk}
-            serializer = FavoriteRecipeSerializer(
-                data=data, context={'request': request}
-            )
-            serializer.is_valid(raise_exception=True)
-            serializer.save()
-
-            return Response(
-                serializer.data,
-                status=status.HTTP_201_CREATED
-            )
-
-        if request.method == 'DELETE':
-            model_instance = Favorite.objects.filter(
-                user=request.user.id, recipe__id=pk
-            )
-            if model_instance.exists():
-                model_instance.delete()
-                return Response(status=status.HTTP_204_NO_CONTENT)
-
-            return Response(status=status.HTTP_400_BAD_REQUEST)
+        favorite = self.toggle_link(
+            request, pk, Favorite, FavoriteRecipeSerializer
+        )
+        if favorite is None:
+            return Response(status=status.HTTP_204_NO_CONTENT)
 
-        return Response(status=status.HTTP_200_OK)
+        return Response(
+            FavoriteRecipeSerializer(favorite).data,
+            status=status.HTTP_201_CREATED
+        )
 
     @action(
         detail=True,
         methods=['POST', 'DELETE']
     )
     def shopping_cart(self, request, pk):
-        if request.method == 'POST':
-            data = {'user': request.user.id, 'recipe': pk}
-            serializer = ShoppingCartRecipeSerializer(
-                data=data, context={'request': request}
-            )
-            serializer.is_valid(raise_exception=True)
-            serializer.save()
+        cart = self.toggle_link(
+            request, pk, ShoppingCart, ShoppingCartRecipeSerializer
+        )
+        if cart is None:
+            return Response(status=status.HTTP_204_NO_CONTENT)
 
-            return Response(
-                serializer.data,
-                status=status.HTTP_201_CREATED
-            )
+        return Response(
+            ShoppingCartRecipeSerializer(cart).data,
+            status=status.HTTP_201_CREATED
+        )
+
+    @action(
+        detail=False,
+        permission_classes=[IsAuthenticated],
+        pagination_class=FeedCursorPagination,
+    )
+    def feed(self, request):
+        """Recipes of the followed authors, newest first."""
+        entries = FeedEntry.objects.filter(user=request.user).prefetch_related(
+            Prefetch('recipe', queryset=with_recipe_details(Recipe.objects))
+        )
+        page = self.paginate_queryset(entries)
+        serializer = RecipeDetailSerializer(
+            [entry.recipe for entry in page],
+            many=True,
+            context=self.get_serializer_context(),
+        )
+        return self.get_paginated_response(serializer.data)
 
-        if request.method == 'DELETE':
-            model_instance = ShoppingCart.objects.filter(
-                user=request.user.id, recipe__id=pk
+    @transaction.atomic
+    def change_links(self, request, model, counter, recipe_set):
+        """Add or remove a batch of favorites or cart entries.
+
+        The links are written with one INSERT ... ON CONFLICT DO NOTHING
+        or DELETE, and both return the recipes they actually changed, so
+        concurrent batches never count the same link twice. Bulk writes
+        skip the model signals, so the recipe counters, cart totals and
+        caches are updated here.
+        """
+        serializer = RecipeBatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        ids = serializer.validated_data['recipes']
+        user = request.user
+
+        if request.method == 'POST':
+            rows = insert_links(model, 'user', user.id, 'recipe', ids)
+            changed = [pk for _, pk in rows]
+            unchanged = set(ids).difference(changed)
+            existing = set(Recipe.objects.filter(
+                pk__in=unchanged
+            ).values_list('pk', flat=True)) if unchanged else set()
+            results = {
+                pk: 'created' if pk in changed else
+                'already_exists' if pk in existing else 'not_found'
+                for pk in ids
+            }
+            delta = 1
+        else:
+            rows = remove_links(model, 'user', user.id, 'recipe', ids)
+            changed = [pk for _, pk in rows]
+            results = {
+                pk: 'deleted' if pk in changed else 'not_found'
+                for pk in ids
+            }
+            delta = -1
+
+        if changed:
+            counters = {counter: F(counter) + delta}
+            if delta > 0:
+                counters['trending_score'] = (
+                    Recipe.trending_score_expression()
+                )
+            Recipe.objects.filter(pk__in=changed).update(**counters)
+            if model is ShoppingCart:
+                ShoppingCartIngredient.change_recipes(user, changed, delta)
+            response_cache.invalidate(*(f'recipe:{pk}' for pk in changed))
+            user_recipe_sets.refresh(
+                user.id, recipe_set, set(changed), added=delta > 0
             )
-            if model_instance.exists():
-                model_instance.delete()
-                return Response(status=status.HTTP_204_NO_CONTENT)
 
-            return Response(status=status.HTTP_400_BAD_REQUEST)
+        return Response({
+            'results': [
+                {'id': pk, 'status': result}
+                for pk, result in results.items()
+            ],
+        })
 
-        return Response(status=status.HTTP_200_OK)
+    @action(
+        detail=False,
+        methods=['POST', 'DELETE'],
+        url_path='favorite',
+        permission_classes=[IsAuthenticated],
+    )
+    def favorite_batch(self, request):
+        return self.change_links(
+            request, Favorite, 'favorites_count', 'favorites'
+        )
 
     @action(
         detail=False,
-        methods=['GET']
+        methods=['POST', 'DELETE'],
+        url_path='shopping_cart',
+        permission_classes=[IsAuthenticated],
+    )
+    def shopping_cart_batch(self, request):
+        return self.change_links(
+            request, ShoppingCart, 'in_carts_count', 'cart'
+        )
+
+    @action(
+        detail=False,
+        methods=['GET'],
+        renderer_classes=[
+            ShoppingListTextRenderer,
+            ShoppingListCSVRenderer,
+            ShoppingListJSONRenderer,
+        ],
     )
     def download_shopping_cart(self, request):
         ingredients = (
-            IngredientInRecipe.objects.filter(
-                recipe__cart__user=request.user)
+            ShoppingCartIngredient.objects.filter(user=request.user)
             .order_by('ingredient__name')
             .values('ingredient__name', 'ingredient__measurement_unit')
-            .annotate(ingredient_value=Sum('amount')))
+            .annotate(ingredient_value=F('amount')))
 
-        if not ingredients:
+        if not ingredients.exists():
             return Response(status=status.HTTP_204_NO_CONTENT)
 
-        shopping_list = (
-            f'Foodgram user {request.user} - shopping list\n\n'
+        renderer = request.accepted_renderer
+        response = StreamingHttpResponse(
+            renderer.stream(ingredients.iterator(), request.user),
+            content_type=f'{renderer.media_type}; charset={renderer.charset}',
         )
-
-        for ingredient in ingredients:
-            item = (
-                f'• {ingredient["ingredient__name"]} - '
-                f'{ingredient["ingredient_value"]} '
-                f'{ingredient["ingredient__measurement_unit"]}'
-            )
-            shopping_list += item + '\n'
-
-        filename = 'foodgram_shopping_list.txt'
-        response = HttpResponse(shopping_list, content_type='text/plain')
+        filename = f'foodgram_shopping_list.{renderer.format}'
         response['Content-Disposition'] = f'attachment; filename={filename}'
 
         return response
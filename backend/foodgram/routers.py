@@ -0,0 +1,94 @@
+import hashlib
+import random
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+use_replica = ContextVar('use_replica', default=False)
+
+
+class PrimaryReplicaRouter:
+    """Send reads of safe requests to a replica, everything else to default.
+
+    Replicas are only used while `ReplicaRoutingMiddleware` allows it, so
+    management commands, background jobs and requests that write always
+    see the primary. Reads follow the database of the instance they
+    start from, and auth tokens are always read from the primary, so a
+    fresh login or logout takes effect immediately.
+    """
+    primary_models = {'authtoken.token'}
+
+    def db_for_read(self, model, **hints):
+        replicas = settings.REPLICA_DATABASES
+        if not replicas or not use_replica.get():
+            return DEFAULT_DB_ALIAS
+
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db:
+            return instance._state.db
+
+        if (model._meta.label_lower in self.primary_models
+                or connections[DEFAULT_DB_ALIAS].in_atomic_block):
+            return DEFAULT_DB_ALIAS
+
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+
+class ReplicaRoutingMiddleware:
+    """Allow replica reads for safe requests, with read-your-writes.
+
+    After a client sends a write, its reads stick to the primary for
+    `REPLICA_STICKY_SECONDS`, so it never sees a replica that has not
+    caught up with its own change yet. Clients are told apart by their
+    Authorization header or session user, and the marker is kept in the
+    default cache, which must be shared between processes to be seen by
+    all of them.
+    """
+    sticky_key = 'replica-sticky:{}'
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def client_key(self, request):
+        credentials = request.headers.get('Authorization')
+        if credentials:
+            return hashlib.sha256(credentials.encode()).hexdigest()
+
+        user = getattr(request, 'user', None)
+        if user is not None and user.is_authenticated:
+            return f'user:{user.pk}'
+
+        return None
+
+    def __call__(self, request):
+        if not settings.REPLICA_DATABASES:
+            return self.get_response(request)
+
+        key = self.client_key(request)
+        safe = request.method in SAFE_METHODS
+        sticky = key is not None and cache.get(self.sticky_key.format(key))
+
+        token = use_replica.set(safe and not sticky)
+        try:
+            response = self.get_response(request)
+        finally:
+            use_replica.reset(token)
+
+        if not safe and key is not None:
+            cache.set(
+                self.sticky_key.format(key),
+                True,
+                settings.REPLICA_STICKY_SECONDS,
+            )
+
+        return response
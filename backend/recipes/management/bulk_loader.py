@@ -0,0 +1,130 @@
+import csv
+import io
+import os
+import time
+from itertools import islice
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from ..signals import bulk_changed
+
+
+class BulkCSVLoadCommand(BaseCommand):
+    """Base command that streams a CSV catalog into a model in batches.
+
+    Rows are read lazily in chunks of `--batch-size` and inserted with
+    `bulk_create(ignore_conflicts=True)`, so rows clashing with one of the
+    model's unique constraints are skipped instead of looked up one by one.
+    On PostgreSQL each chunk is `COPY`-ed into a temporary staging table
+    instead, and a single `INSERT ... ON CONFLICT DO NOTHING` moves the
+    staged rows into place. The whole import runs in one transaction,
+    which `--dry-run` rolls back after reporting what would be inserted.
+    """
+    model = None
+    filename = None
+    fields = ()
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', type=str, required=True)
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Validate and count the rows without saving them.',
+        )
+
+    def handle(self, *args, **options):
+        csv_file_path = os.path.abspath(
+            os.path.join(options['path'], self.filename))
+        batch_size = options['batch_size']
+        if batch_size < 1:
+            raise CommandError('--batch-size must be a positive number.')
+
+        self.read = self.malformed = 0
+        self.started = time.monotonic()
+
+        with open(csv_file_path, 'r', newline='') as file:
+            with transaction.atomic():
+                before = self.model.objects.count()
+                if connection.vendor == 'postgresql':
+                    self.copy_rows(file, batch_size)
+                else:
+                    self.insert_rows(file, batch_size)
+                inserted = self.model.objects.count() - before
+                self.after_load()
+
+                if options['dry_run']:
+                    transaction.set_rollback(True)
+
+        if not options['dry_run']:
+            bulk_changed.send(sender=self.model)
+
+        skipped = self.read - self.malformed - inserted
+        verb = 'would be inserted' if options['dry_run'] else 'inserted'
+        self.stdout.write(self.style.SUCCESS(
+            f'{self.model._meta.verbose_name_plural}: {inserted} {verb}, '
+            f'{skipped} skipped as duplicates, '
+            f'{self.malformed} malformed rows ignored '
+            f'({self.read} rows read in {self.elapsed():.1f}s).')
+        )
+
+    def after_load(self):
+        """Hook for work that has to follow the bulk insert."""
+
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    def chunks(self, file, batch_size):
+        rows = csv.reader(file)
+
+        while True:
+            chunk = list(islice(rows, batch_size))
+            if not chunk:
+                return
+
+            self.read += len(chunk)
+            valid = [row for row in chunk if len(row) == len(self.fields)]
+            self.malformed += len(chunk) - len(valid)
+            yield valid
+
+            self.stdout.write(
+                f'{self.read} rows read, '
+                f'{self.read / max(self.elapsed(), 1e-6):.0f} rows/s'
+            )
+
+    def insert_rows(self, file, batch_size):
+        for chunk in self.chunks(file, batch_size):
+            self.model.objects.bulk_create(
+                [self.model(**dict(zip(self.fields, row))) for row in chunk],
+                ignore_conflicts=True,
+            )
+
+    def copy_rows(self, file, batch_size):
+        table = connection.ops.quote_name(self.model._meta.db_table)
+        staging = connection.ops.quote_name(
+            f'{self.model._meta.db_table}_staging'
+        )
+        columns = ', '.join(
+            connection.ops.quote_name(self.model._meta.get_field(name).column)
+            for name in self.fields
+        )
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'CREATE TEMPORARY TABLE {staging} ON COMMIT DROP AS '
+                f'SELECT {columns} FROM {table} WITH NO DATA'
+            )
+            for chunk in self.chunks(file, batch_size):
+                buffer = io.StringIO()
+                csv.writer(buffer).writerows(chunk)
+                buffer.seek(0)
+                cursor.copy_expert(
+                    f'COPY {staging} ({columns}) FROM STDIN WITH (FORMAT csv)',
+                    buffer,
+                )
+            cursor.execute(
+                f'INSERT INTO {table} ({columns}) '
+                f'SELECT DISTINCT {columns} FROM {staging} '
+                'ON CONFLICT DO NOTHING'
+            )
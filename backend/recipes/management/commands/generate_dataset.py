@@ -0,0 +1,313 @@
+import random
+import time
+from datetime import timedelta
+from io import BytesIO, StringIO
+from itertools import accumulate
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+from PIL import Image
+
+from users.models import Subscription
+
+from ...models import (Favorite, Ingredient, IngredientInRecipe, Recipe,
+                       ShoppingCart, Tag)
+from ...signals import bulk_changed
+
+User = get_user_model()
+
+WORDS = (
+    'apple', 'basil', 'butter', 'carrot', 'chicken', 'chili', 'cinnamon',
+    'garlic', 'ginger', 'honey', 'lemon', 'lentil', 'mushroom', 'onion',
+    'paprika', 'pepper', 'potato', 'rice', 'spinach', 'tomato', 'walnut',
+)
+DISHES = ('soup', 'salad', 'stew', 'pie', 'curry', 'risotto', 'toast')
+UNITS = ('g', 'kg', 'ml', 'l', 'piece', 'tbsp', 'tsp', 'to taste')
+IMAGE_NAME = 'recipe/synthetic.png'
+
+
+class Command(BaseCommand):
+    help = 'Generate a seeded synthetic dataset for local load testing.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=200)
+        parser.add_argument('--recipes', type=int, default=2000)
+        parser.add_argument('--ingredients', type=int, default=1000)
+        parser.add_argument('--tags', type=int, default=12)
+        parser.add_argument('--ingredients-per-recipe', type=int, default=8)
+        parser.add_argument('--subscriptions-per-user', type=int, default=10)
+        parser.add_argument('--favorites-per-user', type=int, default=20)
+        parser.add_argument('--carts-per-user', type=int, default=3)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument(
+            '--prefix',
+            default='synthetic',
+            help='Prefix of the generated user names, tags and ingredients.',
+        )
+        parser.add_argument(
+            '--password',
+            default='synthetic-password',
+            help='Password shared by all generated users.',
+        )
+        parser.add_argument(
+            '--clear',
+            action='store_true',
+            help='Delete a dataset previously generated with this prefix.',
+        )
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        self.prefix = options['prefix']
+        self.started = time.monotonic()
+        if options['users'] < 1 or options['ingredients'] < 1:
+            raise CommandError(
+                'At least one user and one ingredient are required.'
+            )
+
+        existing = User.objects.filter(username__startswith=f'{self.prefix}-')
+        if existing.exists() and not options['clear']:
+            raise CommandError(
+                f'A "{self.prefix}" dataset already exists, pass --clear '
+                'to replace it or --prefix to add another one.'
+            )
+
+        with transaction.atomic():
+            if options['clear']:
+                self.clear()
+
+            users = self.create_users(options['users'], options['password'])
+            tags = self.create_tags(options['tags'])
+            ingredients = self.create_ingredients(options['ingredients'])
+            recipes = self.create_recipes(
+                users, options['recipes'], tags, ingredients,
+                options['ingredients_per_recipe'],
+            )
+            self.create_subscriptions(
+                users, options['subscriptions_per_user']
+            )
+            self.create_links(
+                Favorite, users, recipes, options['favorites_per_user']
+            )
+            self.create_links(
+                ShoppingCart, users, recipes, options['carts_per_user']
+            )
+
+            commands = [
+                'recount_counters', 'rebuild_tags_masks',
+                'rebuild_cart_totals', 'rebuild_feeds',
+                'rebuild_trending_scores',
+            ]
+            if connection.vendor == 'postgresql':
+                commands.append('rebuild_search_index')
+            for command in commands:
+                output = StringIO()
+                call_command(command, stdout=output)
+                self.stdout.write(output.getvalue().splitlines()[-1])
+
+        for model in (User, Tag, Ingredient, Recipe):
+            bulk_changed.send(sender=model)
+        self.stdout.write(self.style.SUCCESS(
+            f'Dataset "{self.prefix}" generated with seed {options["seed"]} '
+            f'in {time.monotonic() - self.started:.1f}s.')
+        )
+
+    def report(self, model, count):
+        self.stdout.write(
+            f'{model._meta.verbose_name_plural}: {count} rows '
+            f'({time.monotonic() - self.started:.1f}s)'
+        )
+
+    def clear(self):
+        User.objects.filter(username__startswith=f'{self.prefix}-').delete()
+        Tag.objects.filter(slug__startswith=f'{self.prefix}-').delete()
+        Ingredient.objects.filter(
+            name__startswith=f'{self.prefix} '
+        ).delete()
+
+    def skewed(self, population):
+        """Cumulative weights that make early items far more popular."""
+        return list(accumulate(1 / rank for rank in range(1, population + 1)))
+
+    def sample(self, population, count, weights):
+        """Draw up to `count` distinct items following `weights`."""
+        count = min(count, len(population))
+        chosen = set()
+        for _ in range(count * 4):
+            if len(chosen) == count:
+                break
+            chosen.add(
+                self.random.choices(population, cum_weights=weights)[0]
+            )
+        return chosen
+
+    def create_users(self, count, password):
+        password = make_password(password)
+        User.objects.bulk_create(
+            (
+                User(
+                    username=f'{self.prefix}-{number}',
+                    email=f'{self.prefix}-{number}@example.com',
+                    first_name=self.random.choice(WORDS).title(),
+                    last_name=self.random.choice(DISHES).title(),
+                    password=password,
+                )
+                for number in range(count)
+            ),
+            batch_size=self.batch_size,
+        )
+        users = list(
+            User.objects.filter(
+                username__startswith=f'{self.prefix}-'
+            ).order_by('id').values_list('id', flat=True)
+        )
+        self.report(User, len(users))
+        return users
+
+    def create_tags(self, count):
+        count = min(count, Tag.MAX_TAGS - Tag.objects.count())
+        colors = set(Tag.objects.values_list('color', flat=True))
+        tags = []
+        while len(tags) < count:
+            color = f'#{self.random.randrange(0x1000000):06X}'
+            if color in colors:
+                continue
+            colors.add(color)
+            number = len(tags)
+            tags.append(Tag(
+                name=f'{self.prefix} {self.random.choice(DISHES)} {number}',
+                color=color,
+                slug=f'{self.prefix}-{number}',
+            ))
+        Tag.objects.bulk_create(tags)
+        Tag.assign_bits()
+
+        tags = list(Tag.objects.order_by('id').values_list('id', flat=True))
+        self.report(Tag, len(tags))
+        return tags
+
+    def create_ingredients(self, count):
+        Ingredient.objects.bulk_create(
+            (
+                Ingredient(
+                    name=(
+                        f'{self.prefix} {self.random.choice(WORDS)} '
+                        f'{self.random.choice(WORDS)} {number}'
+                    ),
+                    measurement_unit=self.random.choice(UNITS),
+                )
+                for number in range(count)
+            ),
+            batch_size=self.batch_size,
+        )
+        ingredients = list(Ingredient.objects.values_list('id', flat=True))
+        self.report(Ingredient, len(ingredients))
+        return ingredients
+
+    def create_image(self):
+        if not default_storage.exists(IMAGE_NAME):
+            buffer = BytesIO()
+            Image.new('RGB', (640, 480), '#EE8D00').save(buffer, 'PNG')
+            default_storage.save(IMAGE_NAME, ContentFile(buffer.getvalue()))
+        return IMAGE_NAME
+
+    def create_recipes(self, users, count, tags, ingredients, per_recipe):
+        image = self.create_image()
+        author_weights = self.skewed(len(users))
+        now = timezone.now()
+
+        Recipe.objects.bulk_create(
+            (
+                Recipe(
+                    author_id=self.random.choices(
+                        users, cum_weights=author_weights
+                    )[0],
+                    name=(
+                        f'{self.random.choice(WORDS).title()} '
+                        f'{self.random.choice(DISHES)}'
+                    ),
+                    text=' '.join(self.random.choices(WORDS, k=40)),
+                    image=image,
+                    cooking_time=self.random.randint(5, 180),
+                )
+                for _ in range(count)
+            ),
+            batch_size=self.batch_size,
+        )
+        recipes = list(
+            Recipe.objects.filter(author__in=users).order_by('id')
+        )
+
+        for recipe in recipes:
+            recipe.pub_date = now - timedelta(
+                minutes=self.random.randrange(365 * 24 * 60)
+            )
+        Recipe.objects.bulk_update(
+            recipes, ['pub_date'], batch_size=self.batch_size
+        )
+        self.report(Recipe, len(recipes))
+
+        ingredient_weights = self.skewed(len(ingredients))
+        Recipe.tags.through.objects.bulk_create(
+            (
+                Recipe.tags.through(recipe_id=recipe.id, tag_id=tag_id)
+                for recipe in recipes
+                for tag_id in self.random.sample(
+                    tags, min(len(tags), self.random.randint(1, 3))
+                )
+            ),
+            batch_size=self.batch_size,
+        )
+        IngredientInRecipe.objects.bulk_create(
+            (
+                IngredientInRecipe(
+                    recipe_id=recipe.id,
+                    ingredient_id=ingredient_id,
+                    amount=self.random.randint(1, 500),
+                )
+                for recipe in recipes
+                for ingredient_id in self.sample(
+                    ingredients, per_recipe, ingredient_weights
+                )
+            ),
+            batch_size=self.batch_size,
+        )
+        self.report(
+            IngredientInRecipe,
+            IngredientInRecipe.objects.filter(recipe__author__in=users).count()
+        )
+        return [recipe.id for recipe in recipes]
+
+    def create_subscriptions(self, users, per_user):
+        weights = self.skewed(len(users))
+        Subscription.objects.bulk_create(
+            (
+                Subscription(user_id=user_id, author_id=author_id)
+                for user_id in users
+                for author_id in self.sample(users, per_user, weights)
+                if author_id != user_id
+            ),
+            batch_size=self.batch_size,
+        )
+        self.report(
+            Subscription, Subscription.objects.filter(user__in=users).count()
+        )
+
+    def create_links(self, model, users, recipes, per_user):
+        weights = self.skewed(len(recipes))
+        model.objects.bulk_create(
+            (
+                model(user_id=user_id, recipe_id=recipe_id)
+                for user_id in users
+                for recipe_id in self.sample(recipes, per_user, weights)
+            ),
+            batch_size=self.batch_size,
+        )
+        self.report(model, model.objects.filter(user__in=users).count())
@@ -0,0 +1,74 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from ...models import ShoppingCartIngredient
+
+
+class Command(BaseCommand):
+    help = 'Rebuild shopping list totals and check them against the carts.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help='Only report differences, do not rewrite the table.',
+        )
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            live = {
+                (user_id, ingredient_id): total
+                for user_id, ingredient_id, total
+                in ShoppingCartIngredient.live_totals()
+            }
+            stored = {
+                (user_id, ingredient_id): amount
+                for user_id, ingredient_id, amount
+                in ShoppingCartIngredient.objects.select_for_update()
+                .values_list('user_id', 'ingredient_id', 'amount')
+            }
+            mismatches = self.compare(live, stored)
+
+            if options['check']:
+                if mismatches:
+                    raise CommandError(
+                        f'{mismatches} shopping list totals are out of date.'
+                    )
+                self.stdout.write(self.style.SUCCESS(
+                    f'All {len(stored)} shopping list totals are up to date.')
+                )
+                return
+
+            ShoppingCartIngredient.objects.all().delete()
+            ShoppingCartIngredient.objects.bulk_create(
+                (
+                    ShoppingCartIngredient(
+                        user_id=user_id,
+                        ingredient_id=ingredient_id,
+                        amount=total,
+                    )
+                    for (user_id, ingredient_id), total in live.items()
+                ),
+                batch_size=options['batch_size'],
+            )
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Shopping list totals rebuilt: {len(live)} rows, '
+            f'{mismatches} fixed.')
+        )
+
+    def compare(self, live, stored):
+        mismatches = 0
+
+        for key in live.keys() | stored.keys():
+            if live.get(key) != stored.get(key):
+                mismatches += 1
+                user_id, ingredient_id = key
+                self.stdout.write(
+                    f'user {user_id}, ingredient {ingredient_id}: '
+                    f'expected {live.get(key, 0)}, '
+                    f'stored {stored.get(key, 0)}'
+                )
+
+        return mismatches
@@ -0,0 +1,59 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from users.models import Subscription
+
+from ...models import FeedEntry
+
+
+class Command(BaseCommand):
+    """Refill every subscription feed from the current subscriptions.
+
+    Each feed gets the latest `FEED_BACKFILL` recipes of every followed
+    author, as if the user had just subscribed to all of them. With
+    `--missing` the existing entries are kept and only absent ones are
+    added, which is safe on every deploy.
+    """
+    help = 'Rebuild the subscription feed of every user.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument(
+            '--missing',
+            action='store_true',
+            help='Keep existing entries and only add absent ones.',
+        )
+
+    def handle(self, *args, **options):
+        latest = {}
+        entries = []
+        with transaction.atomic():
+            if not options['missing']:
+                FeedEntry.objects.all().delete()
+
+            for user_id, author_id in Subscription.objects.values_list(
+                'user_id', 'author_id'
+            ).iterator():
+                if author_id not in latest:
+                    latest[author_id] = list(
+                        FeedEntry.latest_recipes(author_id)
+                    )
+                entries.extend(
+                    FeedEntry(
+                        user_id=user_id,
+                        recipe_id=recipe_id,
+                        author_id=author_id,
+                        pub_date=pub_date,
+                    )
+                    for recipe_id, pub_date in latest[author_id]
+                )
+
+            FeedEntry.objects.bulk_create(
+                entries,
+                batch_size=options['batch_size'],
+                ignore_conflicts=options['missing'],
+            )
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Feeds rebuilt with {len(entries)} entries.')
+        )
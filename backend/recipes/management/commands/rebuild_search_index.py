@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from ...models import Recipe
+from ...signals import bulk_changed
+
+
+class Command(BaseCommand):
+    help = 'Recompute the full-text search vector of every recipe.'
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('Full-text search requires PostgreSQL.')
+
+        updated = Recipe.objects.update(
+            search_vector=Recipe.search_vector_expression()
+        )
+        bulk_changed.send(sender=Recipe)
+        self.stdout.write(self.style.SUCCESS(
+            f'Search vectors rebuilt for {updated} recipes.')
+        )
@@ -0,0 +1,36 @@
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from ...models import Recipe, Tag
+from ...signals import bulk_changed
+
+
+class Command(BaseCommand):
+    help = 'Recompute the tag bitmask of every recipe.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            Tag.assign_bits()
+
+            bits = defaultdict(list)
+            for recipe_id, bit in Recipe.tags.through.objects.values_list(
+                'recipe_id', 'tag__bit'
+            ).iterator():
+                bits[recipe_id].append(bit)
+
+            recipes = list(Recipe.objects.only('id', 'tags_mask'))
+            for recipe in recipes:
+                recipe.tags_mask = Tag.mask(bits[recipe.id])
+            Recipe.objects.bulk_update(
+                recipes, ['tags_mask'], batch_size=options['batch_size']
+            )
+
+        bulk_changed.send(sender=Recipe)
+        self.stdout.write(self.style.SUCCESS(
+            f'Tag masks rebuilt for {len(recipes)} recipes.')
+        )
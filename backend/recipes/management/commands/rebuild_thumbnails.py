@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Q
+
+from ...models import Recipe
+from ...thumbnails import submit_thumbnails, wait_for_thumbnails
+
+
+class Command(BaseCommand):
+    """Generate the thumbnails that are missing.
+
+    Covers recipes created before thumbnails existed and jobs that
+    failed. The jobs run on the same executor as after an upload, and
+    the command waits for all of them before reporting.
+    """
+    help = 'Generate missing recipe thumbnails.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all',
+            action='store_true',
+            help='Regenerate the thumbnails of every recipe.',
+        )
+
+    def handle(self, *args, **options):
+        missing = Q(thumbnail_webp='') | Q(thumbnail_jpeg='')
+        recipes = Recipe.objects.all()
+        if not options['all']:
+            recipes = recipes.filter(missing)
+
+        recipe_ids = list(recipes.values_list('id', flat=True))
+        for recipe_id in recipe_ids:
+            submit_thumbnails(recipe_id)
+        wait_for_thumbnails()
+
+        failed = Recipe.objects.filter(missing, pk__in=recipe_ids).count()
+        if failed:
+            raise CommandError(
+                f'Thumbnails could not be generated for {failed} of '
+                f'{len(recipe_ids)} recipes, see the log for details.'
+            )
+        self.stdout.write(self.style.SUCCESS(
+            f'Thumbnails generated for {len(recipe_ids)} recipes.')
+        )
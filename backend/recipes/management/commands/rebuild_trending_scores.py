@@ -0,0 +1,56 @@
+import math
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from ...models import Recipe
+from ...signals import bulk_changed
+
+
+class Command(BaseCommand):
+    """Seed trending scores from the current counters.
+
+    Favorites and cart entries carry no timestamp, so every existing add
+    is counted as made when its recipe was published. Run this after
+    bulk imports or after changing `TRENDING_HALF_LIFE_HOURS`, which
+    rescales the scores. New adds keep the scores up to date without it.
+    With `--missing` only recipes that have adds but no score yet are
+    seeded, which keeps the live scores and is safe on every deploy.
+    """
+    help = 'Recompute the trending score of every recipe.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument(
+            '--missing',
+            action='store_true',
+            help='Only seed recipes that have adds but no score.',
+        )
+
+    def handle(self, *args, **options):
+        recipes = Recipe.objects.all()
+        if options['missing']:
+            recipes = recipes.filter(trending_score=0).exclude(
+                favorites_count=0, in_carts_count=0
+            )
+
+        with transaction.atomic():
+            recipes = list(recipes.only(
+                'id', 'pub_date', 'favorites_count', 'in_carts_count',
+                'trending_score',
+            ))
+            for recipe in recipes:
+                adds = recipe.favorites_count + recipe.in_carts_count
+                recipe.trending_score = (
+                    Recipe.trending_time(recipe.pub_date) + math.log(adds)
+                    if adds else 0
+                )
+            Recipe.objects.bulk_update(
+                recipes, ['trending_score'],
+                batch_size=options['batch_size'],
+            )
+
+        bulk_changed.send(sender=Recipe)
+        self.stdout.write(self.style.SUCCESS(
+            f'Trending scores rebuilt for {len(recipes)} recipes.')
+        )
@@ -0,0 +1,48 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from users.models import Subscription
+
+from ...models import Favorite, Recipe, ShoppingCart
+from ...signals import bulk_changed
+
+User = get_user_model()
+
+COUNTERS = (
+    (User, 'recipes_count', Recipe, 'author'),
+    (User, 'followers_count', Subscription, 'author'),
+    (Recipe, 'favorites_count', Favorite, 'recipe'),
+    (Recipe, 'in_carts_count', ShoppingCart, 'recipe'),
+)
+
+
+class Command(BaseCommand):
+    help = 'Recount denormalized user and recipe counters.'
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            for model, field, related_model, related_field in COUNTERS:
+                counted = (
+                    related_model.objects
+                    .filter(**{related_field: OuterRef('pk')})
+                    .order_by()
+                    .values(related_field)
+                    .annotate(total=Count('pk'))
+                    .values('total')
+                )
+                updated = model.objects.update(**{
+                    field: Coalesce(
+                        Subquery(counted, output_field=IntegerField()), 0
+                    )
+                })
+                self.stdout.write(
+                    f'{model._meta.verbose_name_plural}.{field}: '
+                    f'{updated} rows recounted.'
+                )
+
+        for model in {model for model, *_ in COUNTERS}:
+            bulk_changed.send(sender=model)
+        self.stdout.write(self.style.SUCCESS('Counters recounted.'))
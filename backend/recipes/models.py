@@ -1,9 +1,22 @@
+import math
+
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVector, SearchVectorField
+from django.core.exceptions import ValidationError
 from django.core.validators import MinValueValidator
-from django.db import models
+from django.db import connections, models, router
+from django.db.models import Case, F, Sum, Value, When
+from django.db.models.functions import Abs, Exp, Greatest, Least, Ln
+from django.utils import timezone
+
+from users.models import Subscription
 
 User = get_user_model()
 
+SEARCH_CONFIG = 'english'
+
 
 class Tag(models.Model):
     COLOR_CHOICES = [
@@ -30,6 +43,14 @@ class Tag(models.Model):
         'Slug',
         unique=True
     )
+    bit = models.PositiveSmallIntegerField(
+        'Bit in recipe tag masks',
+        unique=True,
+        null=True,
+        editable=False,
+    )
+
+    MAX_TAGS = 63
 
     class Meta:
         verbose_name = 'Tag'
@@ -38,6 +59,42 @@ class Tag(models.Model):
     def __str__(self):
         return self.name
 
+    def clean(self):
+        if self.bit is None:
+            self.free_bits(1)
+
+    def save(self, *args, **kwargs):
+        if self.bit is None:
+            self.bit = self.free_bits(1)[0]
+        super().save(*args, **kwargs)
+
+    @classmethod
+    def free_bits(cls, count):
+        used = set(
+            cls.objects.exclude(bit=None).values_list('bit', flat=True)
+        )
+        free = [bit for bit in range(cls.MAX_TAGS) if bit not in used]
+
+        if len(free) < count:
+            raise ValidationError(
+                f'No more than {cls.MAX_TAGS} tags are supported.'
+            )
+
+        return free[:count]
+
+    @classmethod
+    def assign_bits(cls):
+        """Give a bit to tags created without `save`, e.g. in bulk."""
+        tags = list(cls.objects.filter(bit=None).order_by('id'))
+
+        for tag, bit in zip(tags, cls.free_bits(len(tags))):
+            tag.bit = bit
+        cls.objects.bulk_update(tags, ['bit'])
+
+    @staticmethod
+    def mask(bits):
+        return sum(1 << bit for bit in bits if bit is not None)
+
 
 class Ingredient(models.Model):
     name = models.CharField(
@@ -75,6 +132,18 @@ class Recipe(models.Model):
         'Recipe photo',
         upload_to='recipe/',
     )
+    thumbnail_webp = models.ImageField(
+        'Recipe thumbnail (WebP)',
+        upload_to='recipe/thumbnails/',
+        blank=True,
+        editable=False,
+    )
+    thumbnail_jpeg = models.ImageField(
+        'Recipe thumbnail (JPEG)',
+        upload_to='recipe/thumbnails/',
+        blank=True,
+        editable=False,
+    )
     text = models.TextField(
         'Recipe description'
     )
@@ -91,15 +160,90 @@ class Recipe(models.Model):
         'Publish date',
         auto_now_add=True
     )
+    favorites_count = models.PositiveIntegerField(
+        'Favorites count',
+        default=0,
+        editable=False,
+    )
+    in_carts_count = models.PositiveIntegerField(
+        'Shopping lists count',
+        default=0,
+        editable=False,
+    )
+    tags_mask = models.BigIntegerField(
+        'Tags bitmask',
+        default=0,
+        editable=False,
+    )
+    search_vector = SearchVectorField(
+        'Search vector',
+        null=True,
+        editable=False,
+    )
+    trending_score = models.FloatField(
+        'Trending score',
+        default=0,
+        editable=False,
+    )
 
     class Meta:
         ordering = ('-pub_date',)
         verbose_name = 'Recipe'
         verbose_name_plural = 'Recipies'
+        indexes = [
+            models.Index(
+                fields=['-pub_date', '-id'],
+                name='recipe_pub_date_id_idx',
+            ),
+            models.Index(
+                fields=['-favorites_count', '-id'],
+                name='recipe_favorites_count_idx',
+            ),
+            models.Index(
+                fields=['-trending_score', '-id'],
+                name='recipe_trending_score_idx',
+            ),
+            GinIndex(
+                fields=['search_vector'],
+                name='recipe_search_vector_idx',
+            ),
+        ]
 
     def __str__(self):
         return self.name
 
+    @staticmethod
+    def trending_time(moment=None):
+        """Convert a moment to the units of `trending_score`."""
+        moment = moment or timezone.now()
+        return moment.timestamp() * math.log(2) / (
+            settings.TRENDING_HALF_LIFE_HOURS * 3600
+        )
+
+    @classmethod
+    def trending_score_expression(cls):
+        """`trending_score` after one more favorite or cart add right now.
+
+        The score is log(sum(exp(t))) over the times t of every add, so
+        the scores of any two recipes compare like their add counts
+        decayed to the present, and they never need recomputing as time
+        passes. Updates use the log-sum-exp form, which keeps the stored
+        values around `trending_time()` instead of growing exponentially.
+        """
+        score = F('trending_score')
+        now = Value(cls.trending_time())
+        return Greatest(score, now) + Ln(
+            Value(1.0) + Exp(-Least(Abs(score - now), Value(50.0)))
+        )
+
+    @staticmethod
+    def search_vector_expression():
+        """Weighted full-text vector: name ranks above description."""
+        return (
+            SearchVector('name', weight='A', config=SEARCH_CONFIG)
+            + SearchVector('text', weight='B', config=SEARCH_CONFIG)
+        )
+
 
 class IngredientInRecipe(models.Model):
     recipe = models.ForeignKey(
@@ -193,3 +337,246 @@ class Favorite(models.Model):
     def __str__(self):
         return (f'{self.user.username} has '
                 f'{self.recipe.name} in their favorites.')
+
+
+class ShoppingCartIngredient(models.Model):
+    """Running ingredient totals of a user's shopping cart.
+
+    Rows are kept in sync incrementally whenever a recipe enters or leaves
+    the cart, or when a carted recipe has its ingredients edited or is
+    deleted, so the
+    shopping list can be read without aggregating over every recipe.
+    """
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='cart_ingredients',
+        verbose_name='User',
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        on_delete=models.CASCADE,
+        related_name='cart_totals',
+        verbose_name='Ingredient',
+    )
+    amount = models.PositiveIntegerField('Total amount')
+
+    upsert_batch_size = 300
+
+    class Meta:
+        verbose_name = 'Shopping list total'
+        verbose_name_plural = 'Shopping list totals'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'ingredient'],
+                name='unique_cart_ingredient',
+            )
+        ]
+
+    def __str__(self):
+        return f'{self.user} needs {self.amount}x {self.ingredient}'
+
+    @classmethod
+    def apply(cls, user_ids, deltas):
+        """Add per-ingredient `deltas` to the totals of every user given.
+
+        Increases are a single `INSERT ... ON CONFLICT DO UPDATE`, so two
+        carts gaining the same new ingredient at once cannot collide on
+        the unique constraint. Totals that drop to zero are removed.
+        Callers are expected to run this inside the transaction that
+        changes the cart or the recipe.
+        """
+        user_ids = list(user_ids)
+        added = {
+            ingredient_id: delta
+            for ingredient_id, delta in deltas.items() if delta > 0
+        }
+        removed = {
+            ingredient_id: delta
+            for ingredient_id, delta in deltas.items() if delta < 0
+        }
+        if not user_ids or not (added or removed):
+            return
+
+        rows = [
+            (user_id, ingredient_id, delta)
+            for user_id in user_ids
+            for ingredient_id, delta in added.items()
+        ]
+        connection = connections[router.db_for_write(cls)]
+        quote = connection.ops.quote_name
+        table = quote(cls._meta.db_table)
+        with connection.cursor() as cursor:
+            for start in range(0, len(rows), cls.upsert_batch_size):
+                batch = rows[start:start + cls.upsert_batch_size]
+                cursor.execute(
+                    f'INSERT INTO {table} '
+                    f'("user_id", "ingredient_id", "amount") VALUES '
+                    + ', '.join(['(%s, %s, %s)'] * len(batch))
+                    + ' ON CONFLICT ("user_id", "ingredient_id") DO UPDATE '
+                    f'SET "amount" = {table}."amount" + EXCLUDED."amount"',
+                    [value for row in batch for value in row],
+                )
+
+        if removed:
+            totals = cls.objects.filter(
+                user_id__in=user_ids, ingredient_id__in=removed
+            )
+            totals.update(amount=Greatest(
+                F('amount') + Case(*(
+                    When(ingredient_id=ingredient_id, then=Value(delta))
+                    for ingredient_id, delta in removed.items()
+                )),
+                Value(0),
+            ))
+            totals.filter(amount__lte=0).delete()
+
+    @classmethod
+    def recipe_amounts(cls, recipe, sign=1):
+        return {
+            ingredient_id: sign * amount
+            for ingredient_id, amount in IngredientInRecipe.objects.filter(
+                recipe=recipe
+            ).values_list('ingredient_id', 'amount')
+        }
+
+    @classmethod
+    def add_recipe(cls, user_id, recipe):
+        cls.apply([user_id], cls.recipe_amounts(recipe))
+
+    @classmethod
+    def remove_recipe(cls, user_id, recipe):
+        cls.apply([user_id], cls.recipe_amounts(recipe, sign=-1))
+
+    @classmethod
+    def change_recipes(cls, user, recipe_ids, sign=1):
+        """Add several recipes to a cart at once, or remove them."""
+        cls.apply([user.id], {
+            ingredient_id: sign * total
+            for ingredient_id, total in IngredientInRecipe.objects.filter(
+                recipe__in=recipe_ids
+            ).values('ingredient_id').annotate(
+                total=Sum('amount')
+            ).order_by().values_list('ingredient_id', 'total')
+        })
+
+    @classmethod
+    def change_recipe(cls, recipe, deltas):
+        """Propagate an ingredient edit to everyone who carted the recipe."""
+        cls.apply(
+            ShoppingCart.objects.filter(
+                recipe=recipe
+            ).values_list('user_id', flat=True),
+            deltas,
+        )
+
+    @classmethod
+    def live_totals(cls):
+        """Aggregate the totals from scratch for every user."""
+        return (
+            IngredientInRecipe.objects
+            .filter(recipe__cart__isnull=False)
+            .values_list('recipe__cart__user', 'ingredient')
+            .annotate(total=Sum('amount'))
+            .order_by()
+        )
+
+
+class FeedEntry(models.Model):
+    """A recipe in the subscription feed of a user.
+
+    Entries are fanned out to every follower when a recipe is published,
+    backfilled when a user subscribes and trimmed on unsubscribe, so a
+    feed page is a range scan over one user's entries instead of a sort
+    of every followed author's recipes.
+    """
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='feed',
+        verbose_name='Reader',
+    )
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name='Recipe',
+    )
+    author = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name='Recipe author',
+    )
+    pub_date = models.DateTimeField('Publish date')
+
+    class Meta:
+        verbose_name = 'Feed entry'
+        verbose_name_plural = 'Feed entries'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'recipe'],
+                name='feed_entry_unique',
+            )
+        ]
+        indexes = [
+            models.Index(
+                fields=['user', '-pub_date', '-recipe'],
+                name='feed_user_pub_date_idx',
+            ),
+            models.Index(
+                fields=['user', 'author'],
+                name='feed_user_author_idx',
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.recipe} in the feed of {self.user}'
+
+    @staticmethod
+    def latest_recipes(author_id):
+        """The (id, pub_date) of the recipes a new follower gets."""
+        return Recipe.objects.filter(author=author_id).order_by(
+            '-pub_date', '-id'
+        ).values_list('id', 'pub_date')[:settings.FEED_BACKFILL]
+
+    @classmethod
+    def fan_out(cls, recipe):
+        """Add a new recipe to the feed of every follower of its author."""
+        followers = Subscription.objects.filter(
+            author=recipe.author_id
+        ).values_list('user_id', flat=True)
+        cls.objects.bulk_create(
+            [
+                cls(
+                    user_id=user_id,
+                    recipe_id=recipe.id,
+                    author_id=recipe.author_id,
+                    pub_date=recipe.pub_date,
+                )
+                for user_id in followers.iterator()
+            ],
+            batch_size=1000,
+            ignore_conflicts=True,
+        )
+
+    @classmethod
+    def backfill(cls, user_id, author_id):
+        """Add the latest recipes of a newly followed author to a feed."""
+        cls.objects.bulk_create(
+            [
+                cls(
+                    user_id=user_id,
+                    recipe_id=recipe_id,
+                    author_id=author_id,
+                    pub_date=pub_date,
+                )
+                for recipe_id, pub_date in cls.latest_recipes(author_id)
+            ],
+            ignore_conflicts=True,
+        )
+
+    @classmethod
+    def trim(cls, user_id, author_id):
+        """Remove an unfollowed author's recipes from a feed."""
+        cls.objects.filter(user=user_id, author=author_id).delete()
@@ -0,0 +1,201 @@
+from functools import partial
+from threading import local
+
+from django.contrib.auth import get_user_model
+from django.db import connection, connections, transaction
+from django.db.models import F
+from django.db.models.signals import (m2m_changed, post_delete, post_save,
+                                      pre_delete)
+from django.dispatch import Signal, receiver
+
+from users.models import Subscription
+
+from .models import (Favorite, FeedEntry, Recipe, ShoppingCart,
+                     ShoppingCartIngredient, Tag)
+
+User = get_user_model()
+
+deleting = local()
+
+# Sent with the changed model as sender by commands that write in bulk or
+# with queryset updates, which skip the per-row signals.
+bulk_changed = Signal()
+
+
+def forget_deleted_recipe(recipe_id):
+    getattr(deleting, 'recipes', {}).pop(recipe_id, None)
+
+
+def recipe_is_deleted(recipe_id):
+    """Whether `recipe_id` is being deleted by this thread right now.
+
+    Receivers of rows that cascade from a recipe use it to skip per-row
+    work that dies with the recipe anyway, such as its counters.
+
+    A delete that fails between its pre_delete and post_delete signals
+    leaves its mark behind. The mark holds an on_commit callback, which
+    the rollback of that delete discards, so a mark whose callback is no
+    longer pending is stale and forgotten here.
+    """
+    mark = getattr(deleting, 'recipes', {}).get(recipe_id)
+    if mark is None:
+        return False
+
+    using, release = mark
+    if any(func is release for _, func in connections[using].run_on_commit):
+        return True
+
+    forget_deleted_recipe(recipe_id)
+    return False
+
+
+def adjust_counter(model, pk, field, delta):
+    model.objects.filter(pk=pk).update(**{field: F(field) + delta})
+
+
+def count_added_recipe(pk, field):
+    """Count a new favorite or cart add, and let it push the trend."""
+    Recipe.objects.filter(pk=pk).update(**{
+        field: F(field) + 1,
+        'trending_score': Recipe.trending_score_expression(),
+    })
+
+
+@receiver(post_save, sender=Recipe)
+def count_created_recipe(sender, instance, created, **kwargs):
+    if created:
+        adjust_counter(User, instance.author_id, 'recipes_count', 1)
+
+
+@receiver(post_save, sender=Recipe)
+def update_search_vector(sender, instance, update_fields=None, **kwargs):
+    if connection.vendor != 'postgresql':
+        return
+
+    if update_fields and not {'name', 'text'} & set(update_fields):
+        return
+
+    Recipe.objects.filter(pk=instance.pk).update(
+        search_vector=Recipe.search_vector_expression()
+    )
+
+
+@receiver(post_save, sender=Recipe)
+def publish_to_feeds(sender, instance, created, **kwargs):
+    if created:
+        FeedEntry.fan_out(instance)
+
+
+@receiver(pre_delete, sender=Recipe)
+def remove_from_carts(sender, instance, using, **kwargs):
+    # Runs for admin and cascade deletes too, while the cart rows and
+    # ingredients of the recipe still exist.
+    ShoppingCartIngredient.change_recipe(
+        instance, ShoppingCartIngredient.recipe_amounts(instance, sign=-1)
+    )
+    # Deletes always run in a transaction, so the release is pending until
+    # it commits or rolls back.
+    release = partial(forget_deleted_recipe, instance.pk)
+    transaction.on_commit(release, using=using)
+    if not hasattr(deleting, 'recipes'):
+        deleting.recipes = {}
+    deleting.recipes[instance.pk] = (using, release)
+
+
+@receiver(post_delete, sender=Recipe)
+def count_deleted_recipe(sender, instance, **kwargs):
+    forget_deleted_recipe(instance.pk)
+    adjust_counter(User, instance.author_id, 'recipes_count', -1)
+
+
+@receiver(post_save, sender=Favorite)
+def count_created_favorite(sender, instance, created, **kwargs):
+    if created:
+        count_added_recipe(instance.recipe_id, 'favorites_count')
+
+
+@receiver(post_delete, sender=Favorite)
+def count_deleted_favorite(sender, instance, **kwargs):
+    if not recipe_is_deleted(instance.recipe_id):
+        adjust_counter(Recipe, instance.recipe_id, 'favorites_count', -1)
+
+
+@receiver(post_save, sender=ShoppingCart)
+def count_created_cart(sender, instance, created, **kwargs):
+    if created:
+        count_added_recipe(instance.recipe_id, 'in_carts_count')
+
+
+@receiver(post_delete, sender=ShoppingCart)
+def count_deleted_cart(sender, instance, **kwargs):
+    if not recipe_is_deleted(instance.recipe_id):
+        adjust_counter(Recipe, instance.recipe_id, 'in_carts_count', -1)
+
+
+@receiver(post_save, sender=ShoppingCart)
+def add_to_cart_totals(sender, instance, created, **kwargs):
+    if created:
+        ShoppingCartIngredient.add_recipe(
+            instance.user_id, instance.recipe_id
+        )
+
+
+@receiver(post_delete, sender=ShoppingCart)
+def remove_from_cart_totals(sender, instance, **kwargs):
+    # A deleted recipe has already been taken out by remove_from_carts.
+    if not recipe_is_deleted(instance.recipe_id):
+        ShoppingCartIngredient.remove_recipe(
+            instance.user_id, instance.recipe_id
+        )
+
+
+@receiver(post_save, sender=Subscription)
+def backfill_feed(sender, instance, created, **kwargs):
+    if created:
+        FeedEntry.backfill(instance.user_id, instance.author_id)
+
+
+@receiver(post_delete, sender=Subscription)
+def trim_feed(sender, instance, **kwargs):
+    FeedEntry.trim(instance.user_id, instance.author_id)
+
+
+def clear_tag_bit(bit, recipes):
+    recipes.alias(tag_bit=F('tags_mask').bitand(1 << bit)).exclude(
+        tag_bit=0
+    ).update(tags_mask=F('tags_mask').bitand(~(1 << bit)))
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def update_tags_mask(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+
+    if not reverse:
+        instance.tags_mask = Tag.mask(
+            instance.tags.values_list('bit', flat=True)
+        )
+        Recipe.objects.filter(pk=instance.pk).update(
+            tags_mask=instance.tags_mask
+        )
+        return
+
+    # The tags of several recipes changed from the tag side.
+    if instance.bit is None:
+        return
+
+    if action == 'post_add':
+        Recipe.objects.filter(pk__in=pk_set).update(
+            tags_mask=F('tags_mask').bitor(1 << instance.bit)
+        )
+    elif action == 'post_remove':
+        clear_tag_bit(instance.bit, Recipe.objects.filter(pk__in=pk_set))
+    else:
+        clear_tag_bit(instance.bit, Recipe.objects.all())
+
+
+@receiver(post_delete, sender=Tag)
+def release_tag_bit(sender, instance, **kwargs):
+    # The bit is free for the next tag, so no recipe may keep it set.
+    if instance.bit is not None:
+        clear_tag_bit(instance.bit, Recipe.objects.all())
@@ -0,0 +1,126 @@
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor, wait
+from functools import partial
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from django.db import close_old_connections, connection, transaction
+from django.dispatch import Signal
+from PIL import Image, ImageOps
+
+from .models import Recipe
+
+logger = logging.getLogger(__name__)
+
+THUMBNAIL_SIZE = (480, 480)
+VARIANTS = (
+    ('thumbnail_webp', 'WEBP', 'webp', {'quality': 80, 'method': 4}),
+    ('thumbnail_jpeg', 'JPEG', 'jpg', {'quality': 80, 'optimize': True}),
+)
+
+thumbnails_ready = Signal()
+
+executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='thumbnails')
+pending = set()
+
+
+def render_thumbnail(image, image_format, options):
+    buffer = BytesIO()
+    if image_format == 'JPEG' and image.mode == 'RGBA':
+        background = Image.new('RGB', image.size, 'white')
+        background.paste(image, mask=image.getchannel('A'))
+        image = background
+    image.save(buffer, image_format, **options)
+    return ContentFile(buffer.getvalue())
+
+
+def delete_files(storage, names):
+    for name in names:
+        try:
+            storage.delete(name)
+        except Exception:
+            logger.exception('Could not delete thumbnail %s', name)
+
+
+def make_thumbnails(recipe_id):
+    """Generate the thumbnail variants of a recipe photo.
+
+    JPEG sources are decoded at a reduced scale with `draft`, so memory
+    use depends on the thumbnail size rather than on the original photo.
+    The variants are only stored if the photo has not been replaced in
+    the meantime, and whichever files end up unused, the previous
+    variants or the new ones, are deleted.
+    """
+    close_old_connections()
+    try:
+        recipe = Recipe.objects.only(
+            'image', *(field for field, *_ in VARIANTS)
+        ).get(pk=recipe_id)
+        previous = [
+            getattr(recipe, field).name for field, *_ in VARIANTS
+        ]
+        with recipe.image.open('rb') as file, Image.open(file) as image:
+            image.draft('RGB', THUMBNAIL_SIZE)
+            image = ImageOps.exif_transpose(image)
+            image.thumbnail(THUMBNAIL_SIZE)
+            if image.mode not in ('RGB', 'RGBA'):
+                image = image.convert('RGBA')
+
+            stem = os.path.splitext(os.path.basename(recipe.image.name))[0]
+            variants = {}
+            for field, image_format, extension, options in VARIANTS:
+                thumbnail = getattr(recipe, field)
+                thumbnail.save(
+                    f'{stem}.{extension}',
+                    render_thumbnail(image, image_format, options),
+                    save=False,
+                )
+                variants[field] = thumbnail.name
+
+        updated = Recipe.objects.filter(
+            pk=recipe_id, image=recipe.image.name
+        ).update(**variants)
+        if updated:
+            unused = set(previous).difference(variants.values())
+        else:
+            unused = set(variants.values())
+        delete_files(recipe.image.storage, sorted(filter(None, unused)))
+        if updated:
+            thumbnails_ready.send(sender=Recipe, recipe_id=recipe_id)
+    except Exception:
+        logger.exception('Could not create thumbnails for recipe %s',
+                         recipe_id)
+    finally:
+        connection.close()
+
+
+def submit_thumbnails(recipe_id):
+    future = executor.submit(make_thumbnails, recipe_id)
+    pending.add(future)
+    future.add_done_callback(pending.discard)
+
+
+def schedule_thumbnails(recipe):
+    """Queue thumbnail generation once the current transaction commits."""
+    transaction.on_commit(partial(submit_thumbnails, recipe.pk))
+
+
+def discard_thumbnails(recipe):
+    """Delete the current thumbnail files once the transaction commits.
+
+    Used when the photo is replaced, as the new thumbnails get new names.
+    """
+    names = [
+        getattr(recipe, field).name for field, *_ in VARIANTS
+        if getattr(recipe, field)
+    ]
+    if names:
+        transaction.on_commit(
+            partial(delete_files, recipe.thumbnail_webp.storage, names)
+        )
+
+
+def wait_for_thumbnails(timeout=None):
+    """Block until the thumbnails queued so far have been generated."""
+    wait(list(pending), timeout)
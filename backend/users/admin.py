@@ -2,5 +2,18 @@ from django.contrib import admin
 
 from .models import Subscription, User
 
-admin.site.register(User)
+
+@admin.register(User)
+class UserAdmin(admin.ModelAdmin):
+    actions = ('deactivate',)
+
+    @admin.action(description='Deactivate selected users')
+    def deactivate(self, request, queryset):
+        # Saved one by one rather than with update(), so the signals drop
+        # the cached tokens of these users right away.
+        for user in queryset.filter(is_active=True):
+            user.is_active = False
+            user.save(update_fields=['is_active'])
+
+
 admin.site.register(Subscription)
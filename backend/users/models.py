@@ -26,6 +26,16 @@ class User(AbstractUser):
         max_length=200,
         verbose_name='Password'
     )
+    recipes_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Recipes count',
+    )
+    followers_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Followers count',
+    )
 
     class Meta:
         ordering = ('-id',)